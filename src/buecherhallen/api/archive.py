@@ -0,0 +1,111 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+log = logging.getLogger(__name__)
+
+# only responses of these endpoints are captured, never the login itself
+CAPTURED_PATHS = (
+    "/api/items?type=lists",
+    "/api/record?",
+)
+# replays never log in, so lists responses that rejected a session, like a failed session probe, are left out
+SUCCESS_ONLY_PATHS = (
+    "/api/items?type=lists",
+)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class CaptureArchive:
+    """Writes API responses to a gzip-compressed JSON-lines file, one line per response."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__file = gzip.open(path, "wt", encoding="utf-8")
+        self.__lock = threading.Lock()
+        self.captured = 0
+
+    @staticmethod
+    def is_captured(url: str, response: requests.Response) -> bool:
+        if not any(path in url for path in CAPTURED_PATHS):
+            return False
+        return response.status_code == 200 or not any(path in url for path in SUCCESS_ONLY_PATHS)
+
+    def capture(self, url: str, response: requests.Response, elapsed_ms: float):
+        entry = {
+            "url": url,
+            "status": response.status_code,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() in ("content-type", "etag", "last-modified")},
+            "body": response.text,
+        }
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.captured += 1
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+        log.info(f"Captured {self.captured} responses to {self.path}")
+
+
+class ReplayArchive:
+    """Serves API responses from a capture archive instead of the network."""
+
+    def __init__(self, path: str, entries: dict[str, list[dict]]):
+        self.path = path
+        self.__entries = entries
+        self.__served: dict[str, int] = {}
+        self.__lock = threading.Lock()
+
+    def response_for(self, url: str) -> requests.Response:
+        with self.__lock:
+            entries = self.__entries.get(url)
+            if not entries:
+                raise ArchiveError(f"No captured response for {url} in {self.path}")
+            # repeated requests (retries) are answered in capture order, the last response is repeated
+            index = self.__served.get(url, 0)
+            self.__served[url] = index + 1
+            entry = entries[min(index, len(entries) - 1)]
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry.get("headers", {}))
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        return response
+
+
+def create_capture_archive(directory: str) -> CaptureArchive:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"capture-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+    log.info(f"Capturing API responses to {path}")
+    return CaptureArchive(path)
+
+
+def load_replay_archive(path: str) -> ReplayArchive:
+    log.info(f"Replaying API responses from {path}")
+    entries: dict[str, list[dict]] = {}
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entries.setdefault(entry["url"], []).append(entry)
+    except (OSError, ValueError, KeyError) as e:
+        raise ArchiveError(f"Failed to read capture archive {path}: {e}") from e
+    log.info(f"Loaded {sum(len(e) for e in entries.values())} captured responses for {len(entries)} URLs")
+    return ReplayArchive(path, entries)
@@ -0,0 +1,52 @@
+import logging
+import time
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """Point in time by which a run, or one phase of it, has to be done, without `seconds` it never expires."""
+
+    def __init__(self, seconds: Optional[float] = None, parent: Optional['Deadline'] = None):
+        end = time.monotonic() + seconds if seconds else None
+        if parent is not None and parent.end is not None:
+            end = parent.end if end is None else min(end, parent.end)
+        self.end = end
+
+    def phase(self, seconds: Optional[float] = None, reserve: float = 0.0) -> 'Deadline':
+        """Returns a deadline after `seconds`, ending at least `reserve` seconds before this one."""
+        phase = Deadline(seconds, self)
+        if phase.end is not None and self.end is not None and reserve:
+            # keep some time for the phases after this one, but never less than half of what is left
+            phase.end = min(phase.end, max(self.end - reserve, time.monotonic() + self.remaining() / 2))
+        return phase
+
+    def remaining(self) -> Optional[float]:
+        if self.end is None:
+            return None
+        return max(self.end - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.end is not None and time.monotonic() >= self.end
+
+    def check(self, action: str):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {action}")
+
+    def timeout(self, connect_timeout: float, read_timeout: float) -> tuple[float, float]:
+        """Returns the (connect, read) timeouts for a request, clamped to the time left."""
+        remaining = self.remaining()
+        if remaining is None:
+            return connect_timeout, read_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded before sending request")
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+    def fits(self, seconds: float) -> bool:
+        remaining = self.remaining()
+        return remaining is None or seconds < remaining
@@ -0,0 +1,176 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar, TYPE_CHECKING
+
+from buecherhallen.common.metrics import METRICS
+
+if TYPE_CHECKING:
+    import asyncio
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LATENCY_WINDOW = 200
+HEDGE_QUANTILE = 0.95
+MIN_SAMPLES = 20
+# hedges are extra load on the server, so only this share of all requests may be sent twice
+MAX_HEDGE_SHARE = 0.1
+
+
+class LatencyTracker:
+    """Sliding window of request latencies, its 95th percentile is the delay after which a request is hedged."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.__lock = threading.Lock()
+        self.__latencies: collections.deque[float] = collections.deque(maxlen=window)
+
+    def add(self, seconds: float):
+        with self.__lock:
+            self.__latencies.append(seconds)
+
+    def threshold(self) -> Optional[float]:
+        with self.__lock:
+            if len(self.__latencies) < MIN_SAMPLES:
+                return None
+            latencies = sorted(self.__latencies)
+        return latencies[min(int(len(latencies) * HEDGE_QUANTILE), len(latencies) - 1)]
+
+
+class Hedger:
+    """Sends a second copy of a request slower than the observed p95, only for idempotent requests."""
+
+    def __init__(self, max_workers: int):
+        self.__tracker = LatencyTracker()
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers, 1),
+                                                                thread_name_prefix="hedge")
+        self.__lock = threading.Lock()
+        self.__calls = 0
+        self.__hedged = 0
+        self.__hedge_wins = 0
+
+    def call(self, send: Callable[[Callable[[], None]], T]) -> T:
+        """Calls `send`, which has to call the callback right before its request goes out."""
+        started = threading.Event()
+        first = self.__executor.submit(self.__timed, send, started)
+        started.wait()
+        # the threshold is taken once the request is out, requests queued early would otherwise never be hedged
+        threshold = self.__hedge_threshold()
+        if threshold is None:
+            return first.result()
+        try:
+            return first.result(timeout=threshold)
+        except concurrent.futures.TimeoutError:
+            pass
+
+        self.__count_hedge()
+        second = self.__executor.submit(self.__timed, send, None)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # the loser cannot be interrupted, its response is dropped when it arrives
+                    self.__count_win(future is second)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def call_async(self, send: Callable[[Callable[[], None]], Awaitable[T]]) -> T:
+        """Like `call`, for coroutines. The slower request is cancelled."""
+        import asyncio
+
+        started = asyncio.Event()
+        first = asyncio.ensure_future(self.__timed_async(send, started))
+        await started.wait()
+        threshold = self.__hedge_threshold()
+        if threshold is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=threshold)
+        if done:
+            return first.result()
+
+        self.__count_hedge()
+        second = asyncio.ensure_future(self.__timed_async(send, None))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.__count_win(task is second)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def log_stats(self):
+        METRICS.increment("hedged_requests", self.__hedged)
+        METRICS.increment("hedge_wins", self.__hedge_wins)
+        log.info(f"Hedged {self.__hedged} of {self.__calls} requests, the hedge answered first {self.__hedge_wins} "
+                 f"times (p95 threshold {self.__format_threshold()})")
+
+    def close(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def __hedge_threshold(self) -> Optional[float]:
+        with self.__lock:
+            self.__calls += 1
+            if self.__hedged >= self.__calls * MAX_HEDGE_SHARE:
+                return None
+        return self.__tracker.threshold()
+
+    def __count_hedge(self):
+        with self.__lock:
+            self.__hedged += 1
+
+    def __count_win(self, hedge_won: bool):
+        if hedge_won:
+            with self.__lock:
+                self.__hedge_wins += 1
+
+    def __timed(self, send: Callable[[Callable[[], None]], T], started: Optional[threading.Event]) -> T:
+        start_times: list[float] = []
+
+        def on_start():
+            start_times.append(time.monotonic())
+            if started:
+                started.set()
+
+        try:
+            result = send(on_start)
+        finally:
+            if started:
+                started.set()
+        if start_times:
+            self.__tracker.add(time.monotonic() - start_times[0])
+        return result
+
+    async def __timed_async(self, send: Callable[[Callable[[], None]], Awaitable[T]],
+                            started: Optional['asyncio.Event']) -> T:
+        start_times: list[float] = []
+
+        def on_start():
+            start_times.append(time.monotonic())
+            if started:
+                started.set()
+
+        try:
+            result = await send(on_start)
+        finally:
+            if started:
+                started.set()
+        if start_times:
+            self.__tracker.add(time.monotonic() - start_times[0])
+        return result
+
+    def __format_threshold(self) -> str:
+        threshold = self.__tracker.threshold()
+        return f"{threshold * 1000:.0f}ms" if threshold is not None else "not reached"
@@ -0,0 +1,185 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Mapping, Optional
+
+from buecherhallen.common.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+# responses that mean the server is overloaded or throttling us
+OVERLOAD_STATUS_CODES = (429, 500, 502, 503, 504)
+
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.8
+# recent latency above this multiple of the long-term latency counts as congestion
+LATENCY_TOLERANCE = 2.5
+# net count of samples above the tolerance before the limit shrinks, single slow responses are jitter
+CONGESTION_SAMPLES = 5
+RECENT_LATENCY_SMOOTHING = 0.2
+BASELINE_LATENCY_SMOOTHING = 0.02
+
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+MAX_RETRY_AFTER_SECONDS = 300.0
+
+
+class AdaptiveConcurrency:
+    """Shared AIMD limit on the number of API requests in flight."""
+
+    def __init__(self, initial_limit: int, max_limit: int, min_limit: int = 1):
+        self.__min_limit = max(min_limit, 1)
+        self.__max_limit = max(max_limit, self.__min_limit)
+        self.__limit = float(min(max(initial_limit, self.__min_limit), self.__max_limit))
+        self.__condition = threading.Condition()
+        self.__in_flight = 0
+        self.__paused_until = 0.0
+        self.__last_decrease = 0.0
+        self.__recent_latency: Optional[float] = None
+        self.__baseline_latency: Optional[float] = None
+        self.__latency_samples = 0
+        self.__slow_samples = 0
+        self.__peak_limit = self.__limit
+        self.__decreases = 0
+        self.__throttled = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self.__limit)
+
+    @property
+    def max_limit(self) -> int:
+        return self.__max_limit
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        with self.__condition:
+            while True:
+                pause = self.__paused_until - time.monotonic()
+                if pause > 0:
+                    self.__condition.wait(pause)
+                elif self.__in_flight >= self.limit:
+                    self.__condition.wait()
+                else:
+                    self.__in_flight += 1
+                    return
+
+    def release(self):
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify()
+
+    def pause_remaining(self) -> float:
+        return max(self.__paused_until - time.monotonic(), 0.0)
+
+    def on_response(self, status_code: int, latency_seconds: float, retry_after: Optional[float] = None):
+        with self.__condition:
+            if status_code in OVERLOAD_STATUS_CODES:
+                self.__throttled += 1
+                if retry_after:
+                    self.__paused_until = max(self.__paused_until, time.monotonic() + retry_after)
+                self.__decrease(DECREASE_FACTOR)
+            else:
+                self.__observe_latency(latency_seconds)
+                if self.__recent_latency > self.__baseline_latency * LATENCY_TOLERANCE:
+                    self.__slow_samples += 1
+                else:
+                    self.__slow_samples = max(self.__slow_samples - 1, 0)
+                if self.__slow_samples >= CONGESTION_SAMPLES:
+                    self.__slow_samples = 0
+                    self.__decrease(LATENCY_DECREASE_FACTOR)
+                elif self.__slow_samples == 0:
+                    self.__limit = min(self.__limit + 1 / self.__limit, self.__max_limit)
+                    self.__peak_limit = max(self.__peak_limit, self.__limit)
+            self.__condition.notify_all()
+
+    def on_error(self):
+        with self.__condition:
+            self.__decrease(DECREASE_FACTOR)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns the delay before retry number `attempt` (0-based), using full jitter and honoring `Retry-After`."""
+        delay = random.uniform(0, min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS))
+        if retry_after:
+            delay = max(delay, retry_after)
+        return max(delay, self.pause_remaining())
+
+    def log_stats(self):
+        METRICS.set_gauge("concurrency_limit", self.limit)
+        METRICS.set_gauge("concurrency_limit_peak", int(self.__peak_limit))
+        METRICS.increment("concurrency_decreases", self.__decreases)
+        METRICS.increment("throttled_responses", self.__throttled)
+        log.info(f"Concurrency limit ended at {self.limit} (peak {int(self.__peak_limit)}, max {self.__max_limit}), "
+                 f"{self.__decreases} decreases, {self.__throttled} throttled responses")
+
+    def __observe_latency(self, latency_seconds: float):
+        self.__latency_samples += 1
+        if self.__recent_latency is None:
+            self.__recent_latency = self.__baseline_latency = latency_seconds
+            return
+        self.__recent_latency += RECENT_LATENCY_SMOOTHING * (latency_seconds - self.__recent_latency)
+        # a plain mean until the average covers enough samples, the first ones are not representative of the load
+        smoothing = max(BASELINE_LATENCY_SMOOTHING, 1 / self.__latency_samples)
+        self.__baseline_latency += smoothing * (latency_seconds - self.__baseline_latency)
+
+    def __decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self.__last_decrease < (self.__recent_latency or 0.0):
+            return
+        self.__last_decrease = now
+        self.__decreases += 1
+        self.__limit = max(self.__limit * factor, self.__min_limit)
+        if self.__recent_latency is not None:
+            # forget the recent latency level, it belongs to the higher load
+            self.__recent_latency = self.__baseline_latency
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Parses a `Retry-After` header given in seconds or as an HTTP date."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            log.warning(f"Ignoring invalid Retry-After header: {value}")
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+
+class AsyncConcurrencyGate:
+    """Applies the limit of an `AdaptiveConcurrency` to coroutines on one event loop."""
+
+    def __init__(self, controller: AdaptiveConcurrency):
+        import asyncio
+
+        self.__controller = controller
+        self.__condition = asyncio.Condition()
+        self.__in_flight = 0
+
+    async def __aenter__(self):
+        import asyncio
+
+        async with self.__condition:
+            while True:
+                pause = self.__controller.pause_remaining()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self.__condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self.__in_flight >= self.__controller.limit:
+                    await self.__condition.wait()
+                else:
+                    self.__in_flight += 1
+                    return
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        async with self.__condition:
+            self.__in_flight -= 1
+            self.__condition.notify_all()
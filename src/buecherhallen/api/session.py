@@ -0,0 +1,131 @@
+import logging
+import time
+from typing import Any, Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+
+from buecherhallen.api.archive import CaptureArchive, ReplayArchive
+from buecherhallen.api.deadline import Deadline
+from buecherhallen.api.hedging import Hedger
+from buecherhallen.api.rate_control import AdaptiveConcurrency, retry_after_seconds
+from buecherhallen.common.constants import BASE_URL, SOLUS_APP_ID, LOGIN_URL, LISTS_API_URL
+from buecherhallen.common.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+
+class ApiSession:
+    """Shared pooled HTTP client for all calls to the library API."""
+
+    def __init__(self, rate_controller: AdaptiveConcurrency, capture: Optional[CaptureArchive] = None,
+                 replay: Optional[ReplayArchive] = None, connect_timeout: float = 10.0, read_timeout: float = 30.0,
+                 hedging: bool = False):
+        self.rate_controller = rate_controller
+        # replaced by the caller for every phase of a run
+        self.deadline = Deadline()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # a hedge would be captured as a second response, and replayed responses are never slow
+        self.hedger = Hedger(2 * rate_controller.max_limit) if hedging and not capture and not replay else None
+        self.__capture = capture
+        self.__replay = replay
+        self.__session = requests.Session()
+        self.__adapter = HTTPAdapter(pool_connections=1, pool_maxsize=rate_controller.max_limit, pool_block=True)
+        self.__session.mount(BASE_URL, self.__adapter)
+        self.__session.headers.update({'Solus-App-Id': SOLUS_APP_ID})
+
+    def __enter__(self) -> 'ApiSession':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def cookies(self) -> RequestsCookieJar:
+        return self.__session.cookies
+
+    def set_cookies(self, cookies: RequestsCookieJar):
+        self.__session.cookies.update(cookies)
+
+    def get(self, url: str, hedge: bool = False, **kwargs: Any) -> requests.Response:
+        if self.__replay:
+            return self.__replay.response_for(url)
+
+        start = time.monotonic()
+        if hedge and self.hedger:
+            response = self.hedger.call(lambda on_start: self.__send("GET", url, on_start, **kwargs))
+        else:
+            response = self.__send("GET", url, **kwargs)
+        if self.__capture and CaptureArchive.is_captured(url, response):
+            self.__capture.capture(url, response, (time.monotonic() - start) * 1000)
+        return response
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.__send("POST", url, **kwargs)
+
+    def request_timeout(self) -> tuple[float, float]:
+        """Returns the (connect, read) timeout for the next request, raises `DeadlineExceeded` if there is no time left."""
+        return self.deadline.timeout(self.connect_timeout, self.read_timeout)
+
+    def __send(self, method: str, url: str, on_start: Optional[Callable[[], None]] = None,
+               **kwargs: Any) -> requests.Response:
+        self.deadline.check(f"{method} {url}")
+        self.rate_controller.acquire()
+        try:
+            kwargs.setdefault("timeout", self.request_timeout())
+            if on_start:
+                on_start()
+            start = time.monotonic()
+            try:
+                response = self.__session.request(method, url, **kwargs)
+            except requests.RequestException:
+                self.rate_controller.on_error()
+                METRICS.observe_request(ApiSession.request_kind(url), time.monotonic() - start, 0, error=True)
+                raise
+            latency = time.monotonic() - start
+            self.rate_controller.on_response(response.status_code, latency, retry_after_seconds(response.headers))
+            METRICS.observe_request(ApiSession.request_kind(url), latency, len(response.content),
+                                    error=response.status_code >= 400)
+            return response
+        finally:
+            self.rate_controller.release()
+
+    @staticmethod
+    def request_kind(url: str) -> str:
+        """Returns the kind of API call the URL belongs to, the label of its metrics."""
+        if url.startswith(LOGIN_URL):
+            return "login"
+        if url.startswith(LISTS_API_URL):
+            return "lists"
+        if url.startswith(f"{BASE_URL}/api/record"):
+            return "record"
+        return "other"
+
+    def connection_stats(self) -> tuple[int, int]:
+        """Returns the number of requests sent and connections opened by this session."""
+        num_requests = 0
+        num_connections = 0
+        pools = self.__adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+        return num_requests, num_connections
+
+    def log_connection_stats(self):
+        num_requests, num_connections = self.connection_stats()
+        METRICS.set_gauge("http_connections", num_connections)
+        reused = max(num_requests - num_connections, 0)
+        log.info(f"HTTP session sent {num_requests} requests over {num_connections} connections ({reused} reused)")
+
+    def close(self):
+        self.log_connection_stats()
+        self.rate_controller.log_stats()
+        if self.hedger:
+            self.hedger.log_stats()
+            self.hedger.close()
+        self.__session.close()
+        if self.__capture:
+            self.__capture.close()
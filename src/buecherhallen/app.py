@@ -1,54 +1,336 @@
 import concurrent.futures
 import logging
 import sys
+import time
 import traceback
+from typing import Any, NamedTuple, Optional
 
-from buecherhallen.auth.credentials import retrieve_credentials
+import requests
+from requests.cookies import RequestsCookieJar
+
+from buecherhallen.api.archive import create_capture_archive, load_replay_archive
+from buecherhallen.api.deadline import Deadline, DeadlineExceeded
+from buecherhallen.api.rate_control import AdaptiveConcurrency
+from buecherhallen.api.session import ApiSession
+from buecherhallen.auth.cache import cookies_file_for
+from buecherhallen.auth.credentials import retrieve_all_credentials, Credentials
 from buecherhallen.auth.login import login, LoginError
-from buecherhallen.common.options import retrieve_options
+from buecherhallen.common.constants import RECORD_CACHE_FILE, ITEM_SNAPSHOT_FILE, HISTORY_FILE
+from buecherhallen.common.metrics import METRICS
+from buecherhallen.common.options import retrieve_options, Options
+from buecherhallen.common.profiling import PROFILER
+from buecherhallen.media.history import open_history
 from buecherhallen.media.item import retrieve_item_details, Item, ItemParseError
 from buecherhallen.media.list_item import ListItem
-from buecherhallen.media.watchlist import retrieve_watchlist_items, WatchlistError
-from buecherhallen.ui.site import generate_website
+from buecherhallen.media.locations import LOCATIONS
+from buecherhallen.media.prefetch import RecordPrefetcher
+from buecherhallen.media.record_cache import load_record_cache, RecordCache
+from buecherhallen.media.refresh_scheduler import plan_refresh
+from buecherhallen.media.snapshot import load_item_snapshot, ItemSnapshot
+from buecherhallen.media.watchlist import retrieve_named_lists, WatchlistError, save_last_watchlist, \
+    load_last_watchlist
+from buecherhallen.ui.site import generate_list_websites
 
 logger = logging.getLogger(__name__)
 
+# time of the run deadline kept back for fetching the records while logging in and fetching the lists
+RECORDS_RESERVE_SECONDS = 60
+# time of the run deadline kept back for rendering while fetching the records
+RENDER_RESERVE_SECONDS = 10
+
 
 class AppError(Exception):
     pass
 
 
+class RefreshResult(NamedTuple):
+    items_by_list: dict[str, list[Item]]
+    records: int
+    # records that could not be fetched, shown from the snapshot if there is one
+    failed: int
+
+    def failed_share(self) -> float:
+        return self.failed / self.records if self.records else 0.0
+
+
+class AppContext:
+    """Everything that outlives a single refresh: the API session, the worker pool, the caches and the logins."""
+
+    def __init__(self, options: Options):
+        self.options = options
+        # replayed runs need no credentials and must not be influenced by the record cache
+        self.replay = load_replay_archive(options.replay_file) if options.replay_file else None
+        self.accounts = retrieve_all_credentials() if not self.replay else []
+        self.cache = load_record_cache(RECORD_CACHE_FILE, options.record_cache_ttl, options.record_cache_size) \
+            if options.record_cache and not self.replay else None
+        self.capture = create_capture_archive(options.capture_dir) if options.capture_dir else None
+        self.snapshot = load_item_snapshot(ITEM_SNAPSHOT_FILE) if options.degraded and not self.replay else None
+        self.history = open_history(HISTORY_FILE, options.history_retention) \
+            if options.history and not self.replay else None
+        if (self.replay or self.capture) and options.fetch_engine != "threads":
+            raise AppError("Capture and replay are only supported by the 'threads' fetch engine")
+        LOCATIONS.set_preferred(options.locations)
+        if options.locations:
+            logger.info(f"Keeping only copies at {', '.join(options.locations)} and digital copies")
+        # cookies of every account that logged in, reused until the session expires
+        self.account_cookies: dict[int, RequestsCookieJar] = {}
+        # the async engine multiplexes its requests, so its limit may grow up to the number of requests in flight
+        max_limit = options.async_concurrency if options.fetch_engine == "async" else options.max_workers
+        self.session = ApiSession(AdaptiveConcurrency(options.workers, max_limit), self.capture, self.replay,
+                                  options.connect_timeout, options.read_timeout, options.hedge)
+        # the threads only wait for the shared concurrency limit, which decides how many requests are sent at once
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=options.max_workers)
+
+    def __enter__(self) -> 'AppContext':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+        if self.history:
+            self.history.close()
+
+
 def run():
+    options = None
     try:
-        credentials = retrieve_credentials()
         options = retrieve_options()
-        try:
-            cookies = login(credentials, options.cache_cookies, options.headless, options.video_dir)
-        except LoginError as e:
-            raise AppError(f"Login failed: {e}") from e
+        PROFILER.configure(options.profile, options.profile_dir, options.profile_top)
+        with METRICS.phase("setup"):
+            context = AppContext(options)
+        with context:
+            result = refresh(context)
+        with METRICS.phase("render"):
+            generate_list_websites(result.items_by_list, options.output_mode, options.precompress)
+        if result.failed_share() > options.max_failed_share:
+            raise AppError(f"{result.failed} of {result.records} records failed, more than the allowed "
+                           f"{options.max_failed_share:.0%}")
+    except Exception as e:
+        print(traceback.format_exc(), end='', file=sys.stderr)
+        print(f"\nError: {e}", file=sys.stderr)
+        exit(1)
+    finally:
+        # failed runs are the ones whose metrics are needed most
+        if options:
+            write_metrics(options)
 
-        try:
-            list_items = retrieve_watchlist_items(options.list_name, cookies)
-        except WatchlistError as e:
-            raise AppError(f"Failed to retrieve watchlist: {e}") from e
+
+def write_metrics(options: Options):
+    try:
+        METRICS.write(options.metrics_file, options.prometheus_file)
+    except OSError as e:
+        logger.warning(f"Failed to write metrics: {e}")
+
+
+def refresh(context: AppContext) -> RefreshResult:
+    """Downloads the configured lists and their records once, returns the items of every list."""
+    options, session, cache = context.options, context.session, context.cache
+    deadline = Deadline(options.deadline)
+    prefetcher = RecordPrefetcher(context.executor,
+                                  lambda list_item: __retrieve_item(session, options, cache, list_item))
+    try:
+        session.deadline = deadline.phase(reserve=RECORDS_RESERVE_SECONDS)
+        if options.pipeline:
+            __start_prefetch(prefetcher, options, cache)
+
+        lists = __retrieve_lists(context)
+        list_items = __union(lists)
 
         for item in list_items:
             print(item)
+        if options.pipeline:
+            save_last_watchlist(list_items)
 
-        items: list[Item] = []
+        session.deadline = deadline.phase(reserve=RENDER_RESERVE_SECONDS)
+        with METRICS.phase("records"):
+            items, failed = __retrieve_items(session, prefetcher, options, cache, list_items)
+    except DeadlineExceeded as e:
+        raise AppError(f"Run deadline of {options.deadline}s exceeded: {e}") from e
+    finally:
+        prefetcher.cancel()
+        session.deadline = deadline
 
-        def safe_retrieve(list_item: ListItem) -> Item:
-            try:
-                return retrieve_item_details(list_item, options.retries)
-            except ItemParseError as ipe:
-                raise AppError(f"Failed to retrieve item {list_item}: {ipe}") from ipe
+    if cache:
+        cache.log_stats()
+        cache.save()
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=options.workers) as executor:
-            items = list(filter(None, executor.map(safe_retrieve, list_items)))
-        items.sort(key=lambda x: x.signature)
+    if failed:
+        logger.error(f"Failed to fetch {len(failed)} of {len(list_items)} records")
+    if context.snapshot:
+        __apply_snapshot(context.snapshot, cache, items, failed, list_items)
+    if context.history:
+        with METRICS.phase("history"):
+            update = context.history.record_run(items.values())
+            for key, available_since in context.history.available_since(items.keys()).items():
+                items[key].available_since = available_since
+        METRICS.set_gauge("history_changes", update.changes)
+        METRICS.set_gauge("history_became_available", update.became_available)
 
-        generate_website(items)
-    except Exception as e:
-        print(traceback.format_exc(), end='', file=sys.stderr)
-        print(f"\nError: {e}", file=sys.stderr)
-        exit(1)
+    METRICS.set_gauge("lists", len(lists))
+    METRICS.set_gauge("list_entries", sum(len(entries) for entries in lists.values()))
+    METRICS.set_gauge("records", len(list_items))
+    METRICS.set_gauge("failed_records", len(failed))
+    METRICS.set_gauge("stale_records", sum(1 for item in items.values() if item.stale_since is not None))
+    METRICS.set_gauge("locations", len(LOCATIONS))
+    return RefreshResult(__items_by_list(lists, items), len(list_items), len(failed))
+
+
+def __retrieve_lists(context: AppContext) -> dict[str, list[ListItem]]:
+    """Downloads the lists of every account once and merges lists with the same name across accounts."""
+    options = context.options
+    lists: dict[str, list[ListItem]] = {}
+    # replayed runs have no accounts, but still read the captured lists once
+    for account_index, credentials in enumerate(context.accounts or [None]):
+        if credentials:
+            account_lists = __retrieve_account_lists(context, account_index, credentials)
+        else:
+            account_lists = __retrieve_named_lists(context)
+        for list_name, list_items in account_lists.items():
+            lists.setdefault(list_name, []).extend(list_items)
+
+    missing = [list_name for list_name in options.list_names if list_name not in lists]
+    if missing:
+        raise AppError(f"Cannot find lists with names: {', '.join(missing)}")
+    return lists
+
+
+def __retrieve_account_lists(context: AppContext, account_index: int,
+                             credentials: Credentials) -> dict[str, list[ListItem]]:
+    options, session = context.options, context.session
+    session.cookies.clear()
+
+    cookies = context.account_cookies.get(account_index)
+    if cookies is not None:
+        session.set_cookies(cookies)
+        try:
+            with METRICS.phase("lists"):
+                return retrieve_named_lists(options.list_names, session)
+        except WatchlistError as e:
+            logger.info(f"Session of account {account_index + 1} is no longer valid, logging in again: {e}")
+            session.cookies.clear()
+
+    # a browser login takes long, do not start one that cannot finish in time
+    session.deadline.check(f"logging in account {account_index + 1}")
+    try:
+        with METRICS.phase("login"):
+            result = login(credentials, session, options.cache_cookies, options.headless, options.video_dir,
+                           options.interception_mode, cookies_file_for(account_index))
+    except LoginError as e:
+        raise AppError(f"Login failed: {e}") from e
+    context.account_cookies[account_index] = result.cookies
+    session.set_cookies(result.cookies)
+    return __retrieve_named_lists(context, result.lists)
+
+
+def __retrieve_named_lists(context: AppContext,
+                           lists: Optional[list[dict[str, Any]]] = None) -> dict[str, list[ListItem]]:
+    try:
+        with METRICS.phase("lists"):
+            return retrieve_named_lists(context.options.list_names, context.session, lists)
+    except WatchlistError as e:
+        raise AppError(f"Failed to retrieve watchlist: {e}") from e
+
+
+def __union(lists: dict[str, list[ListItem]]) -> list[ListItem]:
+    union: dict[tuple[str, str], ListItem] = {}
+    for list_items in lists.values():
+        for list_item in list_items:
+            union.setdefault((list_item.item_id, list_item.source), list_item)
+    total = sum(len(list_items) for list_items in lists.values())
+    if total != len(union):
+        logger.info(f"{total} list entries reference {len(union)} distinct records")
+    return list(union.values())
+
+
+def __start_prefetch(prefetcher: RecordPrefetcher, options: Options, cache: Optional[RecordCache]):
+    if options.fetch_engine != "threads":
+        logger.warning("Pipelined prefetching is only supported by the 'threads' fetch engine")
+        return
+
+    previous_items = load_last_watchlist()
+    if not previous_items:
+        return
+    if options.refresh_scheduler and cache:
+        previous_items = plan_refresh(previous_items, cache, options.fetch_budget, options.max_staleness,
+                                      options.hot_locations).refresh
+    prefetcher.prefetch(previous_items)
+
+
+def __retrieve_item(session: ApiSession, options: Options, cache: Optional[RecordCache],
+                    list_item: ListItem) -> Optional[Item]:
+    try:
+        return retrieve_item_details(session, list_item, options.retries, cache)
+    except (ItemParseError, DeadlineExceeded, requests.RequestException) as e:
+        if options.degraded:
+            logger.error(f"Failed to retrieve item {list_item.item_id}, continuing without it: {e}")
+            return None
+        if isinstance(e, DeadlineExceeded):
+            raise
+        raise AppError(f"Failed to retrieve item {list_item}: {e}") from e
+
+
+def __retrieve_items(session: ApiSession, prefetcher: RecordPrefetcher, options: Options,
+                     cache: Optional[RecordCache],
+                     list_items: list[ListItem]) -> tuple[dict[tuple[str, str], Item], list[ListItem]]:
+    """Returns the items keyed like the list items, and the list items that failed in degraded mode."""
+    fetched: list[tuple[ListItem, Item]] = []
+
+    to_fetch = list_items
+    if options.refresh_scheduler:
+        if cache:
+            # the records prefetched by the plan of the previous watchlist stay in the plan
+            plan = plan_refresh(list_items, cache, options.fetch_budget, options.max_staleness, options.hot_locations,
+                                prefetcher.prefetched())
+            to_fetch = plan.refresh
+            fetched += [(list_item, Item.from_json(cache.lookup_snapshot(list_item))) for list_item in plan.from_snapshot]
+        else:
+            logger.warning("Refresh scheduler requires the record cache (BH_RECORD_CACHE), fetching all records")
+
+    if options.fetch_engine == "async":
+        from buecherhallen.media.async_fetch import retrieve_items_async
+
+        try:
+            fetched += zip(to_fetch, retrieve_items_async(to_fetch, options.retries, options.max_workers,
+                                                          session, cache, options.degraded))
+        except ItemParseError as ipe:
+            raise AppError(f"Failed to retrieve items: {ipe}") from ipe
+    else:
+        fetched += zip(to_fetch, prefetcher.collect(to_fetch))
+
+    items = {RecordPrefetcher.key(list_item): item for list_item, item in fetched if item is not None}
+    failed = [list_item for list_item in to_fetch if RecordPrefetcher.key(list_item) not in items]
+    return items, failed
+
+
+def __apply_snapshot(snapshot: ItemSnapshot, cache: Optional[RecordCache], items: dict[tuple[str, str], Item],
+                     failed: list[ListItem], list_items: list[ListItem]):
+    """Stores the fetched items as last-known-good copies and substitutes the copies of the failed ones."""
+    for list_item in list_items:
+        item = items.get(RecordPrefetcher.key(list_item))
+        if item is not None:
+            record = cache.get(list_item) if cache else None
+            snapshot.update(item, record.fetched_at if record else None)
+
+    for list_item in failed:
+        stale_item = snapshot.lookup(list_item.item_id, list_item.source)
+        if stale_item is None:
+            logger.warning(f"No snapshot of record {list_item.item_id}, leaving it out")
+            continue
+        logger.warning(f"Showing record {list_item.item_id} from the snapshot of "
+                       f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(stale_item.stale_since))}")
+        items[RecordPrefetcher.key(list_item)] = stale_item
+
+    snapshot.save([RecordPrefetcher.key(list_item) for list_item in list_items])
+
+
+def __items_by_list(lists: dict[str, list[ListItem]], items: dict[tuple[str, str], Item]) -> dict[str, list[Item]]:
+    items_by_list = {}
+    for list_name, list_items in lists.items():
+        keys = dict.fromkeys(RecordPrefetcher.key(list_item) for list_item in list_items)
+        list_view = [items[key] for key in keys if key in items]
+        list_view.sort(key=lambda x: x.signature)
+        items_by_list[list_name] = list_view
+    return items_by_list
@@ -1,95 +1,140 @@
 import logging
 import re
+import time
 from random import randint
+from typing import Callable, Optional, TypeVar
 
 from playwright.sync_api import (
-    Page, Error as PlaywrightError
+    Frame, Page, Error as PlaywrightError
 )
 
+from buecherhallen.common.metrics import METRICS
+
 log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+SOLVE_TIMEOUT_SECONDS = 30.0
+# longest time between two checks for the challenge frame, a token is noticed within `TOKEN_POLLING_MS`
+CHECK_INTERVAL_SECONDS = 0.5
+TOKEN_POLLING_MS = 100
+
+TOKEN_SELECTOR = 'input[name="cf-turnstile-response"]'
+TOKEN_SCRIPT = f"""() => {{
+    const input = document.querySelector('{TOKEN_SELECTOR}');
+    return input && input.value ? input.value : null;
+}}"""
+CHALLENGE_FRAME_PATTERN = re.compile(r'challenges.cloudflare.com/cdn-cgi/challenge-platform/.*')
+CHALLENGE_BOX_SELECTOR = "#cf_turnstile div, #cf-turnstile div, .turnstile > div > div"
+
 
 class BotProtectionError(Exception):
     pass
 
 
-def solve_cloudflare(page: Page) -> str:
+def solve_cloudflare(page: Page, max_seconds: Optional[float] = None) -> str:
+    """Solves the Turnstile challenge on the page and returns its token, clicking only if needed."""
+    start = time.monotonic()
+    deadline = start + (SOLVE_TIMEOUT_SECONDS if max_seconds is None else min(max_seconds, SOLVE_TIMEOUT_SECONDS))
+    detached: list[Frame] = []
+
+    # Playwright sets an attribute on every handler, which a builtin like `detached.append` does not allow
+    def on_detached(frame: Frame):
+        detached.append(frame)
+
+    page.on("framedetached", on_detached)
     try:
-        page.wait_for_load_state("networkidle", timeout=5000)
+        # the challenge either passes without interaction, or shows a checkbox in its iframe or directly on the page
+        found = __wait_until(page, deadline, "waiting for the challenge",
+                             lambda: __read_token(page) or __challenge_frame(page) or __page_challenge_box(page))
+        if isinstance(found, str):
+            token = found
+            clicked = False
+        else:
+            frame = found if isinstance(found, Frame) else None
+            if frame is None:
+                bounding_box = found
+            else:
+                # the iframe has no size until the widget is rendered
+                bounding_box = __wait_until(page, deadline, "waiting for the challenge checkbox",
+                                            lambda: __challenge_box(page, frame))
+            __click_challenge(page, bounding_box)
+            clicked = True
+            METRICS.increment("turnstile_clicks")
+            token = __wait_until(page, deadline, "waiting for the Turnstile token",
+                                 lambda: __read_token(page) or __detached_without_token(page, frame, detached))
+    finally:
+        page.remove_listener("framedetached", on_detached)
+
+    log.debug(f"Turnstile value: {token[:10]}...")
+    log.info(f"Cloudflare challenge solved in {time.monotonic() - start:.1f}s "
+             f"({'after clicking' if clicked else 'without interaction'})")
+    return token
+
+
+def __wait_until(page: Page, deadline: float, action: str, check: Callable[[], Optional[T]]) -> T:
+    """Returns the first truthy result of `check`, waiting for the token in between."""
+    while True:
+        result = check()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BotProtectionError(f"Failed to solve Cloudflare captcha: timed out {action}")
+        try:
+            page.wait_for_function(TOKEN_SCRIPT, polling=TOKEN_POLLING_MS,
+                                   timeout=min(remaining, CHECK_INTERVAL_SECONDS) * 1000)
+        except PlaywrightError:
+            # timeouts, and navigations of the page while the challenge reloads
+            pass
+
+
+def __read_token(page: Page) -> Optional[str]:
+    try:
+        return page.evaluate(TOKEN_SCRIPT)
     except PlaywrightError:
-        pass
+        return None
 
-    bounding_box = None
 
-    iframe = page.frame(url=re.compile(r'challenges.cloudflare.com/cdn-cgi/challenge-platform/.*'))
-    log.info(f"Cloudflare iframe found: {iframe is not None}")
+def __challenge_frame(page: Page) -> Optional[Frame]:
+    return page.frame(url=CHALLENGE_FRAME_PATTERN)
 
-    if iframe is not None:
-        log.info("Wait for iframe")
-        iframe.wait_for_load_state("domcontentloaded")
-        iframe.wait_for_load_state("networkidle")
-        element = iframe.frame_element()
-        element.scroll_into_view_if_needed()
-        bounding_box = element.bounding_box()
 
-        log.debug(f"iframe bounding box: {bounding_box}")
+def __detached_without_token(page: Page, frame: Optional[Frame], detached: list[Frame]) -> None:
+    if frame is not None and frame in detached and not __read_token(page):
+        raise BotProtectionError("Failed to solve Cloudflare captcha: challenge closed without a token")
 
-    # Fallback: try to find the challenge box directly on the page
-    if not bounding_box:
-        log.info("Fallback, try to find directly on page")
-        try:
-            bounding_box = page.locator(
-                "#cf_turnstile div, #cf-turnstile div, .turnstile > div > div").last.bounding_box(timeout=5000)
-            log.debug(f"Fallback bounding box: {bounding_box}")
-        except Exception as e:
-            log.error(f"Failed to get fallback bounding box: {e}")
-            log.info("Fallback to just wait for completion")
-            page.wait_for_timeout(3000)
-            try:
-                page.wait_for_load_state("networkidle", timeout=10000)
-            except PlaywrightError:
-                pass
-            page.wait_for_load_state("load")
-            page.wait_for_load_state("domcontentloaded")
-            log.info("Cloudflare challenge solved?")
-            return extract_turnstile_token(page)
-
-    # If bounding box is found, click the challenge box
+
+def __click_challenge(page: Page, bounding_box: dict[str, float]):
+    log.debug(f"Challenge bounding box: {bounding_box}")
     box_x = bounding_box["x"] + randint(26, 28)
     box_y = bounding_box["y"] + randint(25, 27)
     log.debug(f"Clicking box: (x={box_x}, y={box_y})")
     page.mouse.click(box_x, box_y, button="left", delay=60)
 
-    log.info("Wait for network idle after click")
-    try:
-        page.wait_for_load_state("networkidle", timeout=10000)
-    except PlaywrightError:
-        log.info("Initial network idle timeout, continuing...")
-
-    log.info("Wait for completion")
-    page.wait_for_timeout(3000)
 
-    log.info("Wait for another network idle")
+def __challenge_box(page: Page, frame: Frame) -> Optional[dict[str, float]]:
     try:
-        page.wait_for_load_state("networkidle", timeout=10000)
-    except PlaywrightError:
-        log.info("Network idle timeout, maybe challenge is solved?")
-
-    log.info("Wait for page load")
-    page.wait_for_load_state("load")
-    page.wait_for_load_state("domcontentloaded")
-
-    turnstile_token = extract_turnstile_token(page)
-
-    log.debug(f"Turnstile value: {turnstile_token[:10]}...")
-    log.info("Cloudflare captcha is solved")
-    return turnstile_token
-
+        element = frame.frame_element()
+        element.scroll_into_view_if_needed(timeout=CHECK_INTERVAL_SECONDS * 1000)
+        bounding_box = element.bounding_box()
+    except PlaywrightError as e:
+        log.debug(f"Challenge checkbox not ready yet: {e}")
+        return None
+    if bounding_box and bounding_box["width"]:
+        return bounding_box
+    # fallback: the challenge box directly on the page
+    return __page_challenge_box(page)
 
-def extract_turnstile_token(page: Page) -> str:
-    value = page.locator('input[name="cf-turnstile-response"]').get_attribute('value')
 
-    if not value:
-        log.error("Failed to retrieve Cloudflare turnstile response value")
-        raise BotProtectionError("Failed to solve Cloudflare captcha: Cannot find turnstile response value")
-    return value
+def __page_challenge_box(page: Page) -> Optional[dict[str, float]]:
+    box = page.locator(CHALLENGE_BOX_SELECTOR).last
+    try:
+        # `is_visible` does not wait, so checking for the box does not delay noticing the token
+        if not box.is_visible():
+            return None
+        bounding_box = box.bounding_box(timeout=CHECK_INTERVAL_SECONDS * 1000)
+    except PlaywrightError as e:
+        log.debug(f"Challenge box not ready yet: {e}")
+        return None
+    return bounding_box if bounding_box and bounding_box["width"] else None
@@ -1,15 +1,23 @@
 import json
 import logging
+import os
 from typing import Optional
 
 from requests.cookies import RequestsCookieJar
 
-from buecherhallen.common.constants import COOKIES_FILE
+from buecherhallen.common.constants import COOKIES_FILE, NEXT_ACTION_FILE, INTERCEPTION_COSTS_FILE
 
 log = logging.getLogger(__name__)
 
 
-def cache_cookies(cookies: RequestsCookieJar):
+def cookies_file_for(account_index: int) -> str:
+    if account_index == 0:
+        return COOKIES_FILE
+    base, extension = os.path.splitext(COOKIES_FILE)
+    return f"{base}-{account_index + 1}{extension}"
+
+
+def cache_cookies(cookies: RequestsCookieJar, cookies_file: str = COOKIES_FILE):
     log.info("Caching cookie jar")
 
     cookies_list = []
@@ -24,14 +32,14 @@ def cache_cookies(cookies: RequestsCookieJar):
             "rest": cookie._rest,
         })
 
-    with open(COOKIES_FILE, "w", encoding="utf-8") as f:
+    with open(cookies_file, "w", encoding="utf-8") as f:
         json.dump(cookies_list, f, indent=2)
 
 
-def load_cookies() -> Optional[RequestsCookieJar]:
+def load_cookies(cookies_file: str = COOKIES_FILE) -> Optional[RequestsCookieJar]:
     log.info("Searching cookies jar in cache")
     try:
-        with open(COOKIES_FILE, "r", encoding="utf-8") as f:
+        with open(cookies_file, "r", encoding="utf-8") as f:
             cookies_list = json.load(f)
         cookies_jar = RequestsCookieJar()
         for cookie in cookies_list:
@@ -51,6 +59,48 @@ def load_cookies() -> Optional[RequestsCookieJar]:
         return None
 
 
+def cache_next_action(chunk: str, next_action: str):
+    log.info(f"Caching 'next-action' hash found in chunk {chunk}")
+    with open(NEXT_ACTION_FILE, "w", encoding="utf-8") as f:
+        json.dump({"chunk": chunk, "next_action": next_action}, f, indent=2)
+
+
+def load_next_action() -> Optional[tuple[str, str]]:
+    """Returns the cached chunk filename and the 'next-action' hash found in it."""
+    try:
+        with open(NEXT_ACTION_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return cached["chunk"], cached["next_action"]
+    except FileNotFoundError:
+        log.info("No 'next-action' hash found in cache")
+        return None
+    except (KeyError, ValueError) as e:
+        log.warning(f"Ignoring invalid 'next-action' cache: {e}")
+        return None
+
+
+def cache_interception_costs(costs: dict[str, tuple[float, float]]):
+    log.info("Caching the average size and transfer time of interceptable requests")
+    with open(INTERCEPTION_COSTS_FILE, "w", encoding="utf-8") as f:
+        json.dump({resource_type: {"bytes": size, "duration_ms": duration_ms}
+                   for resource_type, (size, duration_ms) in costs.items()}, f, indent=2)
+
+
+def load_interception_costs() -> Optional[dict[str, tuple[float, float]]]:
+    """Returns the average size in bytes and transfer time in ms by resource type, as measured in 'observe' mode."""
+    try:
+        with open(INTERCEPTION_COSTS_FILE, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        return {resource_type: (float(cost["bytes"]), float(cost["duration_ms"]))
+                for resource_type, cost in cached.items()}
+    except FileNotFoundError:
+        log.info("No interception costs found in cache")
+        return None
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        log.warning(f"Ignoring invalid interception costs cache: {e}")
+        return None
+
+
 def log_cookies(cookies: RequestsCookieJar):
     for cookie in cookies:
         log.debug(
@@ -13,6 +13,18 @@ def retrieve_credentials() -> Credentials:
     return Credentials(username, password)
 
 
+def retrieve_all_credentials() -> list[Credentials]:
+    """Returns the primary account and any additional accounts configured as BH_USERNAME_2/BH_PASSWORD_2, ..."""
+    accounts = [retrieve_credentials()]
+    number = 2
+    while os.getenv(f'BH_USERNAME_{number}') is not None:
+        username = __get_required_env(f'BH_USERNAME_{number}')
+        password = __get_required_env(f'BH_PASSWORD_{number}')
+        accounts.append(Credentials(username, password))
+        number += 1
+    return accounts
+
+
 def __get_required_env(env_name: str) -> str:
     value = os.getenv(env_name)
     if value is None:
@@ -0,0 +1,119 @@
+import logging
+from typing import Optional
+from urllib.parse import urlparse
+
+from playwright.sync_api import Page, Request, Route
+
+log = logging.getLogger(__name__)
+
+# resource types neither the Turnstile challenge nor the 'next-action' discovery need
+BLOCKED_RESOURCE_TYPES = frozenset({
+    "image",
+    "font",
+    "media",
+})
+
+# analytics and tracking hosts loaded by the login page
+BLOCKED_HOSTS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "hotjar.com",
+    "matomo.cloud",
+)
+
+# hosts that are never blocked, the challenge must be able to load everything it asks for
+ALLOWED_HOSTS = (
+    "challenges.cloudflare.com",
+)
+
+
+class RequestInterceptor:
+    """Blocks requests of the login page that neither the challenge nor the login action need."""
+
+    def __init__(self, mode: str, costs: Optional[dict[str, tuple[float, float]]] = None):
+        self.mode = mode
+        # average (bytes, duration in ms) by resource type, from an 'observe' run
+        self.costs = costs
+        self.matched_requests = 0
+        self.matched_bytes = 0
+        self.matched_duration_ms = 0.0
+        self.matched_by_type: dict[str, int] = {}
+        self.bytes_by_type: dict[str, int] = {}
+        self.duration_ms_by_type: dict[str, float] = {}
+
+    def attach(self, page: Page):
+        if self.mode == "block":
+            page.route("**/*", self.__handle_route)
+        elif self.mode == "observe":
+            page.on("requestfinished", self.__observe_request)
+
+    @staticmethod
+    def is_blocked(request: Request) -> bool:
+        hostname = urlparse(request.url).hostname or ""
+        if any(hostname == host or hostname.endswith(f".{host}") for host in ALLOWED_HOSTS):
+            return False
+        if request.resource_type in BLOCKED_RESOURCE_TYPES:
+            return True
+        return any(hostname == host or hostname.endswith(f".{host}") for host in BLOCKED_HOSTS)
+
+    def __handle_route(self, route: Route):
+        request = route.request
+        if RequestInterceptor.is_blocked(request):
+            self.__count(request)
+            route.abort("blockedbyclient")
+        else:
+            route.continue_()
+
+    def __observe_request(self, request: Request):
+        if not RequestInterceptor.is_blocked(request):
+            return
+        self.__count(request)
+        resource_type = request.resource_type
+        try:
+            size = request.sizes().get("responseBodySize", 0)
+            self.matched_bytes += size
+            self.bytes_by_type[resource_type] = self.bytes_by_type.get(resource_type, 0) + size
+        except Exception as e:
+            log.debug(f"Cannot determine size of {request.url}: {e}")
+        timing = request.timing
+        if timing.get("responseEnd", -1) > 0:
+            self.matched_duration_ms += timing["responseEnd"]
+            self.duration_ms_by_type[resource_type] = \
+                self.duration_ms_by_type.get(resource_type, 0.0) + timing["responseEnd"]
+
+    def __count(self, request: Request):
+        self.matched_requests += 1
+        self.matched_by_type[request.resource_type] = self.matched_by_type.get(request.resource_type, 0) + 1
+
+    def costs_by_type(self) -> dict[str, tuple[float, float]]:
+        """Returns the average (bytes, duration in ms) by resource type of the requests observed."""
+        return {resource_type: (self.bytes_by_type.get(resource_type, 0) / count,
+                                self.duration_ms_by_type.get(resource_type, 0.0) / count)
+                for resource_type, count in self.matched_by_type.items()}
+
+    def log_stats(self, load_seconds: float):
+        if self.mode == "block":
+            log.info(f"Login page loaded in {load_seconds:.1f}s, blocked {self.matched_requests} requests "
+                     f"{self.matched_by_type}{self.__estimate_savings()}")
+        elif self.mode == "observe":
+            log.info(f"Login page loaded in {load_seconds:.1f}s, {self.matched_requests} requests "
+                     f"{self.matched_by_type} with {self.matched_bytes} bytes and "
+                     f"{self.matched_duration_ms / 1000:.1f}s of transfer time would have been blocked")
+        else:
+            log.info(f"Login page loaded in {load_seconds:.1f}s")
+
+    def __estimate_savings(self) -> str:
+        if not self.matched_requests:
+            return ""
+        if not self.costs:
+            return ", run once with BH_INTERCEPT=observe to estimate the bytes and time saved"
+        known = {resource_type: count for resource_type, count in self.matched_by_type.items()
+                 if resource_type in self.costs}
+        saved_bytes = sum(count * self.costs[resource_type][0] for resource_type, count in known.items())
+        saved_ms = sum(count * self.costs[resource_type][1] for resource_type, count in known.items())
+        unknown = self.matched_requests - sum(known.values())
+        note = f", {unknown} requests of types never observed left out" if unknown else ""
+        return (f", saving about {saved_bytes:.0f} bytes and {saved_ms / 1000:.1f}s of transfer time "
+                f"(estimated from an observe run{note})")
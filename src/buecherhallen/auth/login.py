@@ -1,35 +1,36 @@
 import logging
 import os
-import re
 import time
-from typing import Optional
+from typing import Any, NamedTuple, Optional, TYPE_CHECKING
 
-import playwright.sync_api
 import requests
-from camoufox.sync_api import Camoufox
-from playwright.sync_api import (
-    Page
-)
 from requests.cookies import RequestsCookieJar
 
-from buecherhallen.auth.bot_protection import solve_cloudflare
-from buecherhallen.auth.cache import cache_cookies, load_cookies
+from buecherhallen.api.session import ApiSession
+from buecherhallen.auth.cache import cache_cookies, load_cookies, load_next_action, cache_interception_costs, \
+    load_interception_costs
 from buecherhallen.auth.credentials import Credentials
-from buecherhallen.common.constants import LOGIN_URL, BASE_HOSTNAME
+from buecherhallen.common.constants import LOGIN_URL, BASE_HOSTNAME, LISTS_API_URL, COOKIES_FILE
+from buecherhallen.common.metrics import METRICS
+
+if TYPE_CHECKING:
+    from playwright.sync_api import Page
 
 log = logging.getLogger(__name__)
 
 EXPIRY_BUFFER_SECONDS = 5 * 60  # 5 minutes
-TOKEN_PATTERN = re.compile(rb'\("([a-f0-9]{42})",[a-zA-Z_$][a-zA-Z0-9_$]*\.callServer,void 0,[a-zA-Z_$][a-zA-Z0-9_$]*\.findSourceMapURL,"turnstileLogin"\)')
-
-# global variable to hold the next-action header value :S
-__turnstile_login_action: Optional[str] = None
 
 
 class LoginError(Exception):
     pass
 
 
+class LoginResult(NamedTuple):
+    cookies: RequestsCookieJar
+    # the lists returned by the session probe, None after a browser login
+    lists: Optional[list[dict[str, Any]]] = None
+
+
 def __check_login_success(cookies: RequestsCookieJar):
     if 'luci_session' not in cookies:
         log.error("luci_session cookie not found after login")
@@ -49,37 +50,61 @@ def __check_login_success(cookies: RequestsCookieJar):
         raise LoginError("luci_session cookie is expired, login has failed")
 
 
-def login(credentials: Credentials, use_cache: bool = False, headless: bool = True, video_dir: Optional[str] = None) -> RequestsCookieJar:
+def login(credentials: Credentials, session: ApiSession, use_cache: bool = False, headless: bool = True, video_dir: Optional[str] = None,
+          interception_mode: str = "off", cookies_file: str = COOKIES_FILE) -> LoginResult:
     if use_cache:
-        log.warning("Cache usage is experimental and might not work as expected!")
         log.info("Checking for cached cookies")
-        cached_cookies = load_cookies()
+        cached_cookies = load_cookies(cookies_file)
         if cached_cookies:
-            try:
-                __check_login_success(cached_cookies)
-                return cached_cookies
-            except LoginError:
-                log.info("Cached cookies are invalid, proceeding to login")
+            with METRICS.phase("login.session_probe"):
+                probed = __probe_session(session, cached_cookies)
+            if probed is not None:
+                cache_cookies(probed.cookies, cookies_file)
+                return probed
+            log.info("Cached cookies are invalid, proceeding to login")
 
     log.info("Starting login process")
+    # the browser stack takes longer to import than all of the rest, runs with a valid session never load it
+    from camoufox.sync_api import Camoufox
+    from buecherhallen.auth.bot_protection import solve_cloudflare
+    from buecherhallen.auth.interception import RequestInterceptor
+    from buecherhallen.auth.next_action import NextActionFinder
 
     turnstile_token = None
     try:
         video_path = None
+        browser_start = time.monotonic()
         with Camoufox(os=["windows", "macos", "linux"], humanize=True, headless=headless) as browser:
             page = browser.new_page(**({"record_video_dir": video_dir} if video_dir else {}))
+            METRICS.add_phase("login.browser_start", time.monotonic() - browser_start)
+            remaining = session.deadline.remaining()
+            if remaining is not None:
+                # browser waits must not outlive the deadline of the login phase either
+                page.set_default_timeout(remaining * 1000)
             __disable_cookie_banner(page)
-            page.on("response", __find_nextjs_next_action)
+            next_action_finder = NextActionFinder(load_next_action())
+            next_action_finder.attach(page)
+            interceptor = RequestInterceptor(interception_mode,
+                                             load_interception_costs() if interception_mode == "block" else None)
+            interceptor.attach(page)
 
+            load_start = time.monotonic()
             page.goto(LOGIN_URL)
             page.wait_for_load_state("domcontentloaded")
             page.wait_for_load_state("networkidle")
+            METRICS.add_phase("login.page_load", time.monotonic() - load_start)
+            interceptor.log_stats(time.monotonic() - load_start)
+            if interception_mode == "observe" and interceptor.matched_requests:
+                cache_interception_costs(interceptor.costs_by_type())
 
-            turnstile_token = solve_cloudflare(page)
+            with METRICS.phase("login.cloudflare"):
+                turnstile_token = solve_cloudflare(page, session.deadline.remaining())
             if video_dir and page.video:
                 video_path = page.video.path()
 
-        cookie_jar_after_login = __login_with_token(credentials, turnstile_token, __turnstile_login_action)
+        with METRICS.phase("login.token"):
+            cookie_jar_after_login = __login_with_token(session, credentials, turnstile_token,
+                                                        next_action_finder.next_action)
 
         if video_path:
             try:
@@ -89,15 +114,45 @@ def login(credentials: Credentials, use_cache: bool = False, headless: bool = Tr
                 log.warning(f"Failed to delete video file {video_path}: {e}")
 
         if use_cache:
-            cache_cookies(cookie_jar_after_login)
-        return cookie_jar_after_login
+            cache_cookies(cookie_jar_after_login, cookies_file)
+        return LoginResult(cookie_jar_after_login)
 
     except Exception as e:
         log.error(f"Login failed: {str(e)}")
         raise LoginError("Login process failed") from e
 
 
-def __disable_cookie_banner(page: Page):
+def __probe_session(session: ApiSession, cookies: RequestsCookieJar) -> Optional[LoginResult]:
+    """Validates cached cookies by fetching the lists, which are returned so they are not fetched again."""
+    if 'luci_session' not in cookies:
+        log.info("No luci_session cookie in cache")
+        return None
+
+    log.info("Validating cached session")
+    session.set_cookies(cookies)
+    try:
+        response = session.get(LISTS_API_URL, allow_redirects=False)
+    except requests.RequestException as e:
+        log.warning(f"Session probe failed: {e}")
+        return None
+
+    log.debug(f"Session probe response status code: {response.status_code}")
+    if response.status_code != 200:
+        log.info(f"Session probe rejected with status code: {response.status_code}")
+        session.cookies.clear()
+        return None
+    try:
+        lists = response.json()
+    except ValueError:
+        log.info("Session probe returned no JSON, session is not valid")
+        session.cookies.clear()
+        return None
+
+    log.info("Cached session is valid, skipping browser login")
+    return LoginResult(session.cookies.copy(), lists)
+
+
+def __disable_cookie_banner(page: 'Page'):
     cookies = [{
         'name': 'luci_CC_28d4dc2f-692b-472b-870d-5e6c35c4ad26',
         'value': 'true',
@@ -112,7 +167,7 @@ def __disable_cookie_banner(page: Page):
     page.context.add_cookies(cookies)
 
 
-def __enter_credentials_and_login(page: Page, credentials: Credentials) -> None:
+def __enter_credentials_and_login(page: 'Page', credentials: Credentials) -> None:
     page.fill('input#bNumber', credentials.username)
     page.fill('input#pin', credentials.password)
     page.click('input#remember-me', force=True)
@@ -121,7 +176,7 @@ def __enter_credentials_and_login(page: Page, credentials: Credentials) -> None:
     page.click('#main-content button[type="submit"]')
 
 
-def extract_cookie_jar(page: Page) -> RequestsCookieJar:
+def extract_cookie_jar(page: 'Page') -> RequestsCookieJar:
     cookies = page.context.cookies()
     cookie_jar = RequestsCookieJar()
     for cookie in cookies:
@@ -144,37 +199,7 @@ def __get_cookie(cookies: RequestsCookieJar, name: str):
     return None
 
 
-def __find_nextjs_next_action(response: playwright.sync_api.Response):
-    global __turnstile_login_action
-    filename = os.path.basename(response.url)
-
-    if __turnstile_login_action:
-        log.debug("Already found 'next-action' hash, skipping response")
-        return
-
-    re_match = re.match(r'https://www2\.buecherhallen\.de/_next/static/chunks/[a-z0-9-]+\.js', response.url)
-
-    if not re_match:
-        return
-    log.debug(f"Matching JS file response found: {filename}")
-
-    if not response.ok:
-        log.warning(f"Failed to load matching JS file for next-action determination {filename}: {response.status}")
-        return
-
-    log.debug(f"Matching JS file loaded successfully: {filename}")
-
-    body = response.body()
-    match = TOKEN_PATTERN.search(body)
-    if match:
-        token = match.group(1).decode('utf-8')
-        log.info(f"Found 'next-action' hash for the login: {token}")
-        __turnstile_login_action = token
-    else:
-        log.debug(f"Failed to find 'next-action' hash in one of the matching JS files: {filename}")
-
-
-def __login_with_token(credentials: Credentials, turnstile_token: str, next_action: Optional[str]) -> RequestsCookieJar:
+def __login_with_token(session: ApiSession, credentials: Credentials, turnstile_token: str, next_action: Optional[str]) -> RequestsCookieJar:
     log.info("Submitting login form with Turnstile token")
     if not next_action:
         log.error("'next-action' hash is missing, cannot proceed with login")
@@ -187,7 +212,7 @@ def __login_with_token(credentials: Credentials, turnstile_token: str, next_acti
         "keepIn": True
     }, False]
 
-    response = requests.post(
+    response = session.post(
         LOGIN_URL,
         headers={
             'next-action': next_action,
@@ -0,0 +1,83 @@
+import logging
+import os
+import re
+from typing import Optional
+
+import playwright.sync_api
+from playwright.sync_api import Page
+
+from buecherhallen.auth.cache import cache_next_action
+from buecherhallen.common.constants import BASE_URL, LOGIN_URL
+
+log = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(rb'\("([a-f0-9]{42})",[a-zA-Z_$][a-zA-Z0-9_$]*\.callServer,void 0,[a-zA-Z_$][a-zA-Z0-9_$]*\.findSourceMapURL,"turnstileLogin"\)')
+CHUNK_URL_PATTERN = re.compile(re.escape(BASE_URL) + r'/_next/static/chunks/[a-z0-9-]+\.js')
+
+
+def find_next_action(body: bytes) -> Optional[str]:
+    """Searches a Next.js JS chunk for the server action hash of the Turnstile login."""
+    match = TOKEN_PATTERN.search(body)
+    if match:
+        return match.group(1).decode('utf-8')
+    return None
+
+
+class NextActionFinder:
+    """Determines the 'next-action' hash of the login from the responses of the login page."""
+
+    def __init__(self, cached: Optional[tuple[str, str]]):
+        self.__cached = cached
+        self.__page: Optional[Page] = None
+        self.next_action: Optional[str] = None
+
+    def attach(self, page: Page):
+        self.__page = page
+        page.on("response", self.on_response)
+
+    def on_response(self, response: playwright.sync_api.Response):
+        if self.next_action:
+            return
+
+        if response.url == LOGIN_URL and self.__cached:
+            self.__check_cached_chunk_in_document(response)
+            return
+
+        if not CHUNK_URL_PATTERN.match(response.url):
+            return
+        filename = os.path.basename(response.url)
+        log.debug(f"Matching JS file response found: {filename}")
+
+        if self.__cached and filename == self.__cached[0]:
+            log.info(f"Cached chunk {filename} is served again, using cached 'next-action' hash")
+            self.__found(self.__cached[1])
+            return
+
+        if not response.ok:
+            log.warning(f"Failed to load matching JS file for next-action determination {filename}: {response.status}")
+            return
+
+        log.debug(f"Matching JS file loaded successfully: {filename}")
+        token = find_next_action(response.body())
+        if token:
+            log.info(f"Found 'next-action' hash for the login: {token}")
+            cache_next_action(filename, token)
+            self.__found(token)
+        else:
+            log.debug(f"Failed to find 'next-action' hash in one of the matching JS files: {filename}")
+
+    def __check_cached_chunk_in_document(self, response: playwright.sync_api.Response):
+        try:
+            document = response.text()
+        except playwright.sync_api.Error as e:
+            log.debug(f"Cannot read login page document: {e}")
+            return
+        if f"/_next/static/chunks/{self.__cached[0]}" in document:
+            log.info(f"Login page references cached chunk {self.__cached[0]}, using cached 'next-action' hash")
+            self.__found(self.__cached[1])
+
+    def __found(self, token: str):
+        self.next_action = token
+        if self.__page is not None:
+            # stop inspecting the remaining responses of the page load
+            self.__page.remove_listener("response", self.on_response)
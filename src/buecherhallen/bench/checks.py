@@ -0,0 +1,110 @@
+import argparse
+import logging
+import random
+import sys
+import tempfile
+from typing import Callable
+
+from buecherhallen.api.rate_control import AdaptiveConcurrency
+from buecherhallen.bench.load import run_load
+from buecherhallen.bench.standin_server import StandinConfig, StandinServer
+
+REFRESH_BUDGET = 10
+REFRESH_CYCLES = 3
+
+CONCURRENCY_LIMIT = 16
+LATENCY_SAMPLES = 300
+LATENCY_SEEDS = 10
+BASE_LATENCY_SECONDS = 0.03
+# latency of every response after half of the samples in the congested case, as a multiple of the base latency
+CONGESTED_LATENCY_FACTOR = 8
+
+
+class CheckError(Exception):
+    pass
+
+
+def check_refresh_budget_with_pipeline():
+    """With the refresh scheduler and pipelining, a run with a warm cache fetches at most the budget."""
+    env = {
+        "BH_RECORD_CACHE": "true",
+        "BH_RECORD_CACHE_TTL": "0",
+        "BH_REFRESH_SCHEDULER": "true",
+        "BH_FETCH_BUDGET": str(REFRESH_BUDGET),
+        "BH_PIPELINE": "true",
+    }
+    with tempfile.TemporaryDirectory(prefix="bh-check-") as workdir, \
+            StandinServer(StandinConfig(items=60)) as server:
+        for cycle in range(REFRESH_CYCLES):
+            before = server.stats.requests.get("record", 0)
+            result = run_load(server, 60, env, workdir)
+            if result.exit_code != 0:
+                raise CheckError(f"run {cycle + 1} failed with exit code {result.exit_code}")
+            record_requests = server.stats.requests.get("record", 0) - before
+            # the first run has no cache, every record is missing and must be fetched
+            if cycle > 0 and record_requests > REFRESH_BUDGET:
+                raise CheckError(f"run {cycle + 1} made {record_requests} record requests, "
+                                 f"more than the budget of {REFRESH_BUDGET}")
+
+
+def check_latency_noise_keeps_limit():
+    """Latency jitter without overload responses leaves the concurrency limit alone, a lasting slowdown shrinks it."""
+    for seed in range(LATENCY_SEEDS):
+        lowest = __lowest_limit(seed, congested=False)
+        if lowest < CONCURRENCY_LIMIT:
+            raise CheckError(f"noisy latency (seed {seed}) shrank the limit from {CONCURRENCY_LIMIT} to {lowest}")
+        if __lowest_limit(seed, congested=True) == CONCURRENCY_LIMIT:
+            raise CheckError(f"{CONGESTED_LATENCY_FACTOR}x latency (seed {seed}) did not shrink the limit")
+
+
+def __lowest_limit(seed: int, congested: bool) -> int:
+    rng = random.Random(seed)
+    controller = AdaptiveConcurrency(CONCURRENCY_LIMIT, CONCURRENCY_LIMIT)
+    lowest = controller.limit
+    for sample in range(LATENCY_SAMPLES):
+        latency = BASE_LATENCY_SECONDS * rng.lognormvariate(0, 0.4)
+        # the first response is the small lists request, faster than the record requests
+        if sample == 0:
+            latency /= 4
+        # one in twenty responses is several times slower, like a GC pause on the server
+        if rng.random() < 0.05:
+            latency *= rng.uniform(3, 6)
+        if congested and sample >= LATENCY_SAMPLES // 2:
+            latency *= CONGESTED_LATENCY_FACTOR
+        controller.on_response(200, latency)
+        lowest = min(lowest, controller.limit)
+    return lowest
+
+
+CHECKS: dict[str, Callable[[], None]] = {
+    "refresh_budget_with_pipeline": check_refresh_budget_with_pipeline,
+    "latency_noise_keeps_limit": check_latency_noise_keeps_limit,
+}
+
+
+def run_checks(names: list[str]) -> list[str]:
+    """Returns a description of every check that failed."""
+    failures = []
+    for name in names:
+        try:
+            CHECKS[name]()
+            print(f"{name:<40} ok", file=sys.stderr)
+        except CheckError as e:
+            print(f"{name:<40} FAILED: {e}", file=sys.stderr)
+            failures.append(f"{name}: {e}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regression checks of the pipeline, against the stand-in server")
+    parser.add_argument("--only", nargs="+", choices=sorted(CHECKS), help="run only these checks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    failures = run_checks(args.only or list(CHECKS))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
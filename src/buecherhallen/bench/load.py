@@ -0,0 +1,123 @@
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import requests
+
+from buecherhallen.bench.standin_server import StandinServer, add_config_arguments, config_from_arguments, \
+    SESSION_COOKIE
+
+DEFAULT_SIZES = (10, 1_000, 10_000)
+
+
+class LoadResult:
+    def __init__(self, items: int, exit_code: int, wall_seconds: float, requests: dict[str, int],
+                 peak_rss_kb: int, phases: dict[str, float]):
+        self.items = items
+        self.exit_code = exit_code
+        self.wall_seconds = wall_seconds
+        self.requests = requests
+        self.peak_rss_kb = peak_rss_kb
+        self.phases = phases
+
+    def requests_per_second(self) -> float:
+        return sum(self.requests.values()) / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def to_json(self) -> dict:
+        return {
+            "items": self.items,
+            "exit_code": self.exit_code,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "requests": self.requests,
+            "requests_per_second": round(self.requests_per_second(), 1),
+            "peak_rss_kb": self.peak_rss_kb,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+
+def run_load(server: StandinServer, items: int, env: dict[str, str], workdir: Optional[str] = None) -> LoadResult:
+    """Runs the full app pipeline in a subprocess against the stand-in server."""
+    with contextlib.nullcontext(workdir) if workdir else tempfile.TemporaryDirectory(prefix="bh-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "output"), exist_ok=True)
+        __write_session_cookies(server, workdir)
+
+        app_env = {
+            **os.environ,
+            "BH_BASE_URL": server.base_url,
+            "BH_USERNAME": "benchmark",
+            "BH_PASSWORD": "benchmark",
+            "BH_CACHE_COOKIES": "true",
+            "BH_LOG_LEVEL": os.environ.get("BH_LOG_LEVEL", "WARN"),
+            **env,
+        }
+        start = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, "-c", "from buecherhallen.main import main; main()"],
+            cwd=workdir,
+            env=app_env,
+            stdout=subprocess.DEVNULL,
+        )
+        _, status, rusage = os.wait4(process.pid, 0)
+        end = time.monotonic()
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    stats = server.stats
+    phases = {"startup": stats.first_request.get("lists", end) - start}
+    if "record" in stats.first_request:
+        phases["records"] = stats.last_request["record"] - stats.first_request["record"]
+        phases["render"] = end - stats.last_request["record"]
+    return LoadResult(items, process.returncode, end - start, dict(stats.requests), rusage.ru_maxrss, phases)
+
+
+def __write_session_cookies(server: StandinServer, workdir: str):
+    # log in through the emulated server action so the app reuses the session instead of starting a browser
+    response = requests.post(f"{server.base_url}/user/login", headers={"next-action": "benchmark"}, json=[])
+    response.raise_for_status()
+    cookies = [{
+        "name": cookie.name,
+        "value": cookie.value,
+        "domain": cookie.domain,
+        "path": cookie.path,
+        "expires": cookie.expires,
+        "secure": cookie.secure,
+        "rest": {},
+    } for cookie in response.cookies if cookie.name == SESSION_COOKIE]
+    with open(os.path.join(workdir, "cookies.json"), "w", encoding="utf-8") as f:
+        json.dump(cookies, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the full pipeline against a local stand-in server")
+    parser.add_argument("--items", type=int, nargs="+", default=list(DEFAULT_SIZES), help="watchlist sizes")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="additional environment variables for the app, e.g. BH_WORKERS=8")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    env = dict(entry.split("=", 1) for entry in args.env)
+    results = []
+    for items in args.items:
+        with StandinServer(config_from_arguments(args, items)) as server:
+            result = run_load(server, items, env)
+        results.append(result)
+        if not args.json:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result.phases.items())
+            print(f"{items:>6} items: {result.wall_seconds:7.2f}s wall, {sum(result.requests.values()):>6} requests, "
+                  f"{result.requests_per_second():8.1f} req/s, {result.peak_rss_kb / 1024:6.1f} MiB peak RSS, "
+                  f"exit code {result.exit_code} ({phases})")
+
+    if args.json:
+        print(json.dumps([result.to_json() for result in results], indent=2))
+    if any(result.exit_code != 0 for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import gc
+import tracemalloc
+
+from buecherhallen.bench.standin_server import StandinConfig, generate_record, generate_list_item, item_id
+from buecherhallen.media.item import Item
+from buecherhallen.media.list_item import ListItem
+
+
+def measure_retained_bytes(items: int, copies: int, branches: int) -> tuple[int, int]:
+    """Returns the bytes retained by the parsed list items and items of a synthetic watchlist."""
+    config = StandinConfig(items=items, copies=copies, branches=branches)
+    raw_list_items = [generate_list_item(index) for index in range(items)]
+    raw_items = [generate_record(config, item_id(index), "ILS") for index in range(items)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        list_items = [ListItem.from_json(raw) for raw in raw_list_items]
+        after_list_items, _ = tracemalloc.get_traced_memory()
+        parsed_items = [Item.from_json(raw) for raw in raw_items]
+        gc.collect()
+        after_items, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(list_items) == len(parsed_items) == items
+    return after_list_items - before, after_items - after_list_items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the memory retained per parsed watchlist item")
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--copies", type=int, default=10)
+    parser.add_argument("--branches", type=int, default=30)
+    args = parser.parse_args()
+
+    list_item_bytes, item_bytes = measure_retained_bytes(args.items, args.copies, args.branches)
+    print(f"{args.items} items with {args.copies} copies over {args.branches} branches:")
+    print(f"  ListItem: {list_item_bytes:>12,} B total, {list_item_bytes / args.items:>8.1f} B per item")
+    print(f"  Item:     {item_bytes:>12,} B total, {item_bytes / args.items:>8.1f} B per item")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from buecherhallen.bench.standin_server import StandinConfig, generate_list_item, generate_record, item_id
+from buecherhallen.media.item import Item
+from buecherhallen.media.list_item import ListItem
+from buecherhallen.media.locations import LOCATIONS
+from buecherhallen.ui.index import create_env, render_index
+from buecherhallen.ui.site import generate_website
+
+DEFAULT_BASELINE = "benchmarks/micro_baseline.json"
+DEFAULT_THRESHOLD_PERCENT = 25.0
+MIN_REPEAT_SECONDS = 0.05
+# branches kept by the benchmarks of the location filter, as named by the stand-in server
+PREFERRED_LOCATIONS = ["Branch 001", "Branch 002", "Branch 003"]
+
+
+def __generate_items(count: int, copies: int, branches: int) -> list[Item]:
+    config = StandinConfig(items=count, copies=copies, branches=branches)
+    return [Item.from_json(generate_record(config, item_id(index), "ILS")) for index in range(count)]
+
+
+def __setup_list_item_from_json() -> Callable[[], object]:
+    raw = generate_list_item(42)
+    return lambda: ListItem.from_json(raw)
+
+
+def __setup_item_from_json(copies: int, preferred: Optional[list[str]] = None) -> Callable[[], Callable[[], object]]:
+    def setup() -> Callable[[], object]:
+        LOCATIONS.set_preferred(preferred)
+        raw = generate_record(StandinConfig(copies=copies, branches=100), item_id(42), "ILS")
+        return lambda: Item.from_json(raw)
+
+    return setup
+
+
+def __setup_is_video_game() -> Callable[[], object]:
+    item = __generate_items(1, 1, 1)[0]
+    return item.is_video_game
+
+
+def __setup_render_index(preferred: Optional[list[str]] = None) -> Callable[[], Callable[[], object]]:
+    def setup() -> Callable[[], object]:
+        LOCATIONS.set_preferred(preferred)
+        env = create_env()
+        items = __generate_items(10_000, 10, 100)
+        return lambda: render_index(env, items)
+
+    return setup
+
+
+def __setup_generate_website() -> Callable[[], object]:
+    items = __generate_items(1_000, 10, 100)
+    workdir = tempfile.mkdtemp(prefix="bh-micro-")
+    os.makedirs(os.path.join(workdir, "output"))
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            generate_website(items)
+        finally:
+            os.chdir(cwd)
+
+    return run
+
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], object]]] = {
+    "list_item_from_json": __setup_list_item_from_json,
+    "item_from_json_1_copy": __setup_item_from_json(1),
+    "item_from_json_50_copies": __setup_item_from_json(50),
+    "item_from_json_500_copies": __setup_item_from_json(500),
+    "item_from_json_500_copies_3_locations": __setup_item_from_json(500, PREFERRED_LOCATIONS),
+    "item_is_video_game": __setup_is_video_game,
+    "render_index_10k_items_100_locations": __setup_render_index(),
+    "render_index_10k_items_3_locations": __setup_render_index(PREFERRED_LOCATIONS),
+    "generate_website_1k_items": __setup_generate_website,
+}
+
+
+def __calibration_workload():
+    # a fixed mix of the dict, string and list work the parser and renderer spend their time on
+    record = {f"key{index}": str(index) for index in range(200)}
+    rows = [(key, value.upper(), len(value)) for key, value in record.items() if value]
+    return "".join(f"<td>{key}</td><td>{value}</td>" for key, value, _ in rows)
+
+
+def calibrate(repeat: int) -> float:
+    """Returns the time in microseconds of a fixed workload, the unit the timings are normalized by."""
+    return measure(__calibration_workload, repeat)["time_us"]
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict[str, float]:
+    """Returns the best time per call in microseconds and the peak bytes allocated by a single call."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_REPEAT_SECONDS:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(MIN_REPEAT_SECONDS / elapsed) + 1)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+
+    tracemalloc.start()
+    try:
+        baseline_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "time_us": min(timings) * 1_000_000,
+        "alloc_bytes": peak_memory - baseline_memory,
+    }
+
+
+def run_benchmarks(names: list[str], repeat: int) -> dict[str, dict[str, float]]:
+    results = {}
+    for name in names:
+        # every benchmark starts without a location filter, the ones that need one set it up themselves
+        LOCATIONS.set_preferred(None)
+        func = BENCHMARKS[name]()
+        results[name] = measure(func, repeat)
+        print(f"{name:<40} {results[name]['time_us']:>14.1f} us {results[name]['alloc_bytes']:>14,} B",
+              file=sys.stderr)
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]],
+            threshold_percent: float, time_scale: float = 1.0) -> list[str]:
+    """Returns every metric that regressed by more than the threshold, timings (`*_us`) scaled by `time_scale`."""
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            print(f"{name}: no baseline", file=sys.stderr)
+            continue
+        for metric, value in metrics.items():
+            base = baseline[name].get(metric)
+            if not base:
+                continue
+            if metric.endswith("_us"):
+                base *= time_scale
+            change = (value - base) / base * 100
+            print(f"{name:<40} {metric:<12} {base:>14.1f} -> {value:>14.1f} ({change:+.1f}%)", file=sys.stderr)
+            if change > threshold_percent:
+                regressions.append(f"{name} {metric} regressed by {change:.1f}% ({base:.1f} -> {value:.1f})")
+    return regressions
+
+
+def write_baseline(path: str, results: dict[str, dict[str, float]], calibration_us: float):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"python": platform.python_version(), "calibration_us": calibration_us, "benchmarks": results},
+                  f, indent=2)
+        f.write("\n")
+    print(f"Baseline written to {path}", file=sys.stderr)
+
+
+def read_baseline(path: str, calibration_us: float) -> tuple[dict[str, dict[str, float]], float]:
+    """Returns the benchmarks of a baseline and how much slower this host is than the one that recorded it."""
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if "calibration_us" not in baseline:
+        print(f"{path} has no calibration, recreate it with 'update-baseline'", file=sys.stderr)
+        sys.exit(1)
+    if baseline.get("python") != platform.python_version():
+        # allocations and timings differ between interpreter versions, the calibration only covers the host
+        print(f"Baseline was recorded with Python {baseline.get('python')}, this is "
+              f"{platform.python_version()}", file=sys.stderr)
+    time_scale = calibration_us / baseline["calibration_us"]
+    print(f"This host is {time_scale:.2f}x as slow as the baseline host", file=sys.stderr)
+    return baseline["benchmarks"], time_scale
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks for the parser and renderer. Timings are compared relative to a calibration "
+                    "workload timed in the same process, so a baseline recorded on another host stays usable. "
+                    "Recreate the baseline with 'update-baseline' after intended changes or a Python upgrade.")
+    parser.add_argument("command", choices=("run", "compare", "update-baseline"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PERCENT,
+                        help="allowed slowdown in percent before 'compare' fails")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    args = parser.parse_args()
+
+    # calibrated before and after the benchmarks, the faster of both is the least disturbed by other load
+    calibration_us = calibrate(args.repeat)
+    results = run_benchmarks(args.only or list(BENCHMARKS), args.repeat)
+    calibration_us = min(calibration_us, calibrate(args.repeat))
+    print(f"{'calibration':<40} {calibration_us:>14.1f} us", file=sys.stderr)
+
+    if args.command == "run":
+        print(json.dumps(results, indent=2))
+    elif args.command == "update-baseline":
+        write_baseline(args.baseline, results, calibration_us)
+    else:
+        benchmarks, time_scale = read_baseline(args.baseline, calibration_us)
+        regressions = compare(results, benchmarks, args.threshold, time_scale)
+        if regressions:
+            print("\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions above {args.threshold}%", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+log = logging.getLogger(__name__)
+
+SESSION_COOKIE = "luci_session"
+SESSION_VALUE = "standin-session"
+
+
+class StandinConfig:
+    def __init__(
+        self,
+        items: int = 100,
+        copies: int = 10,
+        branches: int = 30,
+        digital_copies: int = 1,
+        latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        list_name: str = "Merkliste",
+        seed: int = 0,
+    ):
+        self.items = items
+        self.copies = copies
+        self.branches = branches
+        self.digital_copies = digital_copies
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.list_name = list_name
+        self.seed = seed
+
+
+class StandinStats:
+    """Request counts and the time of the first and last request per endpoint."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.requests: dict[str, int] = {}
+        self.first_request: dict[str, float] = {}
+        self.last_request: dict[str, float] = {}
+
+    def count(self, endpoint: str):
+        now = time.monotonic()
+        with self.__lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.first_request.setdefault(endpoint, now)
+            self.last_request[endpoint] = now
+
+
+def item_id(index: int) -> str:
+    return f"{index:08d}"
+
+
+def generate_list_item(index: int) -> dict:
+    return {
+        "id": item_id(index),
+        "source": "ILS",
+        "additionalMetaData": [
+            {"key": "title", "value": f"Title {index}"},
+            {"key": "author", "value": f"Author {index % 97}"},
+        ],
+    }
+
+
+def generate_record(config: StandinConfig, record_id: str, source: str) -> dict:
+    rng = random.Random(f"{config.seed}-{record_id}")
+    index = int(record_id) if record_id.isdigit() else 0
+    is_game = index % 17 == 0
+    return {
+        "recordID": record_id,
+        "source": source,
+        "title": f"Title {index}",
+        "author": f"Author {index % 97}",
+        "format": "Konsolenspiel" if is_game else "Buch",
+        "mainMetadata": [
+            {"key": "Signatur", "usableValue": f"1 @ {rng.choice('ABCDEFGHIJ')} {index}"},
+            {"key": "Genre", "usableValue": "Konsolenspiel" if is_game else "Roman"},
+        ],
+        "copies": [{
+            "location": {"locationName": f"Branch {rng.randrange(max(config.branches, 1)):03d}"},
+            "available": rng.random() < 0.3,
+            "shelf": "",
+        } for _ in range(config.copies)],
+        "digitalCopies": [{
+            "available": rng.random() < 0.5,
+            "count": 1,
+        } for _ in range(config.digital_copies)],
+    }
+
+
+def create_handler(config: StandinConfig, stats: StandinStats) -> type[BaseHTTPRequestHandler]:
+    lists_body = json.dumps([
+        {"listName": config.list_name, "items": [generate_list_item(index) for index in range(config.items)]},
+    ]).encode("utf-8")
+
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            log.debug(format % args)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/api/items" and query.get("type") == ["lists"]:
+                stats.count("lists")
+                if not self.__simulate_conditions():
+                    return
+                if f"{SESSION_COOKIE}={SESSION_VALUE}" not in self.headers.get("Cookie", ""):
+                    self.__send(401, b'{"error":"unauthorized"}')
+                    return
+                self.__send(200, lists_body)
+            elif url.path == "/api/record" and "id" in query:
+                stats.count("record")
+                if not self.__simulate_conditions():
+                    return
+                record = generate_record(config, query["id"][0], query.get("source", ["ILS"])[0])
+                body = json.dumps(record).encode("utf-8")
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.__send(304, b"", {"ETag": etag})
+                    return
+                self.__send(200, body, {"ETag": etag})
+            else:
+                self.__send(404, b'{"error":"not found"}')
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            if url.path == "/user/login" and self.headers.get("next-action"):
+                stats.count("login")
+                self.__send(200, b'0:["$@1"]\n1:{"success":true}\n', {
+                    "Content-Type": "text/x-component",
+                    "Set-Cookie": f"{SESSION_COOKIE}={SESSION_VALUE}; Path=/; Max-Age=86400; HttpOnly",
+                })
+            else:
+                self.__send(404, b'{"error":"not found"}')
+
+        def __simulate_conditions(self) -> bool:
+            if config.latency_ms > 0:
+                time.sleep(config.latency_ms / 1000)
+            roll = random.random()
+            if roll < config.throttle_rate:
+                self.__send(429, b'{"error":"too many requests"}', {"Retry-After": "1"})
+                return False
+            if roll < config.throttle_rate + config.error_rate:
+                self.__send(500, b'{"error":"internal error"}')
+                return False
+            return True
+
+        def __send(self, status: int, body: bytes, headers: dict[str, str] | None = None):
+            self.send_response(status)
+            headers = headers or {}
+            self.send_header("Content-Type", headers.pop("Content-Type", "application/json"))
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return StandinHandler
+
+
+class StandinServer:
+    """Local HTTP server emulating the lists, record and login endpoints of the library API."""
+
+    def __init__(self, config: StandinConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.stats = StandinStats()
+        self.__server = ThreadingHTTPServer((host, port), create_handler(config, self.stats))
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'StandinServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.__thread.start()
+        log.info(f"Stand-in server listening on {self.base_url}")
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--copies", type=int, default=10, help="physical copies per record")
+    parser.add_argument("--branches", type=int, default=30, help="number of branches copies are spread over")
+    parser.add_argument("--digital-copies", type=int, default=1, help="digital copies per record")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added latency per API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API requests answered with 429")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_arguments(args: argparse.Namespace, items: int) -> StandinConfig:
+    return StandinConfig(
+        items=items,
+        copies=args.copies,
+        branches=args.branches,
+        digital_copies=args.digital_copies,
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the library API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--items", type=int, default=100, help="number of items on the watchlist")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = StandinServer(config_from_arguments(args, args.items), port=args.port)
+    server.start()
+    print(f"Serving on {server.base_url}, run the app with BH_BASE_URL={server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from buecherhallen.bench.micro import compare, read_baseline, write_baseline
+
+DEFAULT_BASELINE = "benchmarks/startup_baseline.json"
+DEFAULT_THRESHOLD_PERCENT = 25.0
+# a stdlib module of about the size of the startup path, its import time is the unit the timings are normalized by
+CALIBRATION_MODULE = "urllib.request"
+
+# module imported by every benchmark, and the modules it must not pull in
+BENCHMARKS = {
+    "main": ("buecherhallen.main", ("camoufox", "playwright", "jinja2", "asyncio", "cProfile", "sqlite3")),
+    "login": ("buecherhallen.auth.login", ("camoufox", "playwright")),
+    "site": ("buecherhallen.ui.site", ("jinja2",)),
+}
+
+
+def measure_import(module: str) -> dict[str, int]:
+    """Returns the cumulative import time in us of `module` and every module it loaded."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented, the top level ones besides `module` happen at interpreter startup
+        nested = name.startswith("   ")
+        if nested or name.strip() == module:
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def calibrate(repeat: int) -> float:
+    """Returns the median import time in us of the calibration module, measured like the benchmarks."""
+    return statistics.median(measure_import(CALIBRATION_MODULE)[CALIBRATION_MODULE] for _ in range(repeat))
+
+
+def run_benchmarks(names: list[str], repeat: int) -> tuple[dict[str, dict[str, float]], list[str]]:
+    """Returns the median import time of every benchmark and the heavy modules imported that should not be."""
+    results = {}
+    violations = []
+    for name in names:
+        module, forbidden = BENCHMARKS[name]
+        runs = [measure_import(module) for _ in range(repeat)]
+        results[name] = {"import_us": statistics.median(run[module] for run in runs)}
+        heaviest = sorted(runs[-1].items(), key=lambda entry: entry[1], reverse=True)
+        top = ", ".join(f"{module_name} {us / 1000:.1f}ms" for module_name, us in heaviest[1:6])
+        print(f"{name:<10} {results[name]['import_us'] / 1000:>10.1f} ms  (heaviest: {top})", file=sys.stderr)
+        violations += [f"{name}: imports {module_name}" for module_name in forbidden if module_name in runs[-1]]
+    return results, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the entry points, using -X importtime. Times "
+                                                 f"are compared relative to the import time of {CALIBRATION_MODULE}, "
+                                                 "so a baseline recorded on another host stays usable.")
+    parser.add_argument("command", choices=("run", "compare", "update-baseline"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PERCENT,
+                        help="allowed slowdown in percent before 'compare' fails")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    args = parser.parse_args()
+
+    # calibrated before and after the benchmarks like the micro-benchmarks, an import instead of their in-process
+    # workload because import times follow the disk cache and process startup of the host as well
+    calibration_us = calibrate(args.repeat)
+    results, violations = run_benchmarks(args.only or list(BENCHMARKS), args.repeat)
+    calibration_us = min(calibration_us, calibrate(args.repeat))
+    if violations:
+        # a heavy import on the startup path is a regression regardless of the timings
+        print("\n".join(violations), file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == "run":
+        print(json.dumps(results, indent=2))
+    elif args.command == "update-baseline":
+        write_baseline(args.baseline, results, calibration_us)
+    else:
+        benchmarks, time_scale = read_baseline(args.baseline, calibration_us)
+        regressions = compare(results, benchmarks, args.threshold, time_scale)
+        if regressions:
+            print("\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions above {args.threshold}%", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
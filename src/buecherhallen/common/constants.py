@@ -1,5 +1,18 @@
-BASE_HOSTNAME = 'www2.buecherhallen.de'
-BASE_URL = f'https://{BASE_HOSTNAME}'
+import os
+from urllib.parse import urlparse
+
+# can be overridden to run against a local stand-in server, see buecherhallen.bench.standin_server
+BASE_URL = os.environ.get('BH_BASE_URL', 'https://www2.buecherhallen.de').rstrip('/')
+BASE_HOSTNAME = urlparse(BASE_URL).hostname
 LOGIN_URL = f'{BASE_URL}/user/login'
+LISTS_API_URL = f'{BASE_URL}/api/items?type=lists'
 SOLUS_APP_ID = '28d4dc2f-692b-472b-870d-5e6c35c4ad26'
 COOKIES_FILE = 'cookies.json'
+NEXT_ACTION_FILE = 'next_action.json'
+INTERCEPTION_COSTS_FILE = 'interception_costs.json'
+RECORD_CACHE_FILE = 'record_cache.json'
+LAST_WATCHLIST_FILE = 'last_watchlist.json'
+TEMPLATE_CACHE_DIR = '.template_cache'
+ITEM_SNAPSHOT_FILE = 'item_snapshot.json'
+METRICS_FILE = 'metrics.json'
+HISTORY_FILE = 'history.sqlite3'
@@ -0,0 +1,169 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+from buecherhallen.common.profiling import PROFILER
+
+log = logging.getLogger(__name__)
+
+# upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_PREFIX = "buecherhallen"
+
+
+class RequestStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latencies: list[float] = []
+
+    def observe(self, seconds: float, size: int, error: bool):
+        self.count += 1
+        self.errors += error
+        self.bytes += size
+        self.latency_sum += seconds
+        self.latencies.append(seconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+                break
+
+    def percentile(self, quantile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+    def to_json(self) -> dict[str, Any]:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(LATENCY_BUCKETS, self.bucket_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = self.count
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "latency_seconds": {
+                "sum": round(self.latency_sum, 6),
+                "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95),
+                "max": max(self.latencies, default=None),
+                "buckets": buckets,
+            },
+        }
+
+
+class Metrics:
+    """Thread-safe collector of the phase timings, request stats, counters and gauges of one run."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__started_at = time.time()
+            self.__phases: dict[str, float] = {}
+            self.__requests: dict[str, RequestStats] = {}
+            self.__counters: dict[str, int] = {}
+            self.__gauges: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times the block as phase `name`, phases that run more than once add up. Profiled if enabled."""
+        start = time.monotonic()
+        try:
+            with PROFILER.phase(name):
+                yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def add_phase(self, name: str, seconds: float):
+        """Adds time measured by the caller, for phases that do not fit a `with` block."""
+        with self.__lock:
+            self.__phases[name] = self.__phases.get(name, 0.0) + seconds
+        log.debug(f"Phase {name} took {seconds:.3f}s")
+
+    def observe_request(self, kind: str, seconds: float, size: int, error: bool = False):
+        with self.__lock:
+            stats = self.__requests.get(kind)
+            if stats is None:
+                stats = self.__requests[kind] = RequestStats()
+            stats.observe(seconds, size, error)
+
+    def increment(self, name: str, value: int = 1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def to_json(self) -> dict[str, Any]:
+        with self.__lock:
+            return {
+                "started_at": self.__started_at,
+                "duration_seconds": round(time.time() - self.__started_at, 6),
+                "phases": {name: round(seconds, 6) for name, seconds in self.__phases.items()},
+                "requests": {kind: stats.to_json() for kind, stats in sorted(self.__requests.items())},
+                "counters": dict(sorted(self.__counters.items())),
+                "gauges": dict(sorted(self.__gauges.items())),
+            }
+
+    def to_prometheus(self) -> str:
+        content = self.to_json()
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_run_timestamp_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_timestamp_seconds {content['started_at']:.3f}",
+            f"# TYPE {PROMETHEUS_PREFIX}_run_duration_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_run_duration_seconds {content['duration_seconds']}",
+            f"# TYPE {PROMETHEUS_PREFIX}_phase_duration_seconds gauge",
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_phase_duration_seconds{{phase="{name}"}} {seconds}'
+                  for name, seconds in content["phases"].items()]
+
+        histogram = f"{PROMETHEUS_PREFIX}_request_duration_seconds"
+        lines += [f"# TYPE {histogram} histogram"]
+        for kind, stats in content["requests"].items():
+            lines += [f'{histogram}_bucket{{kind="{kind}",le="{bound}"}} {count}'
+                      for bound, count in stats["latency_seconds"]["buckets"].items()]
+            lines += [f'{histogram}_sum{{kind="{kind}"}} {stats["latency_seconds"]["sum"]}',
+                      f'{histogram}_count{{kind="{kind}"}} {stats["count"]}']
+        for name, key in (("request_bytes_total", "bytes"), ("request_errors_total", "errors")):
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name} counter"]
+            lines += [f'{PROMETHEUS_PREFIX}_{name}{{kind="{kind}"}} {stats[key]}'
+                      for kind, stats in content["requests"].items()]
+
+        for name, value in content["counters"].items():
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter", f"{PROMETHEUS_PREFIX}_{name}_total {value}"]
+        for name, value in content["gauges"].items():
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge", f"{PROMETHEUS_PREFIX}_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Optional[str], prometheus_path: Optional[str] = None):
+        if json_path:
+            Metrics.__write_atomic(json_path, json.dumps(self.to_json(), indent=2) + "\n")
+            log.info(f"Wrote metrics to {json_path}")
+        if prometheus_path:
+            Metrics.__write_atomic(prometheus_path, self.to_prometheus())
+            log.info(f"Wrote Prometheus metrics to {prometheus_path}")
+
+    @staticmethod
+    def __write_atomic(path: str, content: str):
+        # the textfile collector may read at any time, so the file is replaced as a whole
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+METRICS = Metrics()
@@ -1,40 +1,186 @@
 import os
 from typing import Optional
 
+from buecherhallen.common.constants import METRICS_FILE
+from buecherhallen.common.profiling import PROFILE_MODES
+
+FETCH_ENGINES = ("threads", "async")
+INTERCEPTION_MODES = ("off", "observe", "block")
+OUTPUT_MODES = ("single", "split")
+
 
 class Options:
     def __init__(
         self,
-        list_name: str,
+        list_names: list[str],
         cache_cookies: bool,
         headless: bool,
         retries: int,
         workers: int,
+        max_workers: int,
         video_dir: Optional[str],
+        fetch_engine: str,
+        async_concurrency: int,
+        record_cache: bool,
+        record_cache_ttl: int,
+        record_cache_size: int,
+        refresh_scheduler: bool,
+        fetch_budget: int,
+        max_staleness: int,
+        hot_locations: int,
+        interception_mode: str,
+        pipeline: bool,
+        capture_dir: Optional[str],
+        replay_file: Optional[str],
+        output_mode: str,
+        precompress: bool,
+        serve_host: str,
+        serve_port: int,
+        serve_interval: int,
+        serve_jitter: int,
+        deadline: int,
+        connect_timeout: float,
+        read_timeout: float,
+        hedge: bool,
+        degraded: bool,
+        max_failed_share: float,
+        metrics_file: Optional[str],
+        prometheus_file: Optional[str],
+        profile: str,
+        profile_dir: str,
+        profile_top: int,
+        history: bool,
+        history_retention: int,
+        locations: list[str],
     ):
-        self.list_name = list_name
-        self.cache_cookies = cache_cookies  # experimental, just for testing right now
+        self.list_names = list_names
+        self.cache_cookies = cache_cookies
         self.headless = headless
         self.retries = retries
-        self.workers = workers
+        self.workers = workers  # initial concurrency limit
+        self.max_workers = max_workers  # upper bound for the adaptive concurrency limit
         self.video_dir = video_dir
+        self.fetch_engine = fetch_engine  # 'threads' or 'async'
+        self.async_concurrency = async_concurrency
+        self.record_cache = record_cache
+        self.record_cache_ttl = record_cache_ttl  # seconds a cached record is served without revalidation
+        self.record_cache_size = record_cache_size
+        self.refresh_scheduler = refresh_scheduler  # requires the record cache
+        self.fetch_budget = fetch_budget  # 0 means no limit
+        self.max_staleness = max_staleness  # seconds
+        self.hot_locations = hot_locations
+        self.interception_mode = interception_mode  # 'off', 'observe' or 'block'
+        self.pipeline = pipeline  # prefetch the records of the last run while logging in
+        self.capture_dir = capture_dir
+        self.replay_file = replay_file
+        self.output_mode = output_mode  # 'single' or 'split'
+        self.precompress = precompress  # write .gz (and .br) siblings for servers that serve them as they are
+        self.serve_host = serve_host
+        self.serve_port = serve_port
+        self.serve_interval = serve_interval  # seconds between refreshes in serve mode
+        self.serve_jitter = serve_jitter  # maximum seconds added to or removed from the interval
+        self.deadline = deadline  # seconds a run may take, 0 means no limit
+        self.connect_timeout = connect_timeout  # seconds
+        self.read_timeout = read_timeout  # seconds
+        self.hedge = hedge  # send a second copy of slow record fetches
+        self.degraded = degraded  # show last-known-good copies of records that cannot be fetched
+        self.max_failed_share = max_failed_share  # share of failed records above which a run fails, 0.0 to 1.0
+        self.metrics_file = metrics_file  # JSON file the metrics of a run are written to
+        self.prometheus_file = prometheus_file  # optional textfile for the Prometheus node exporter
+        self.profile = profile  # 'off', 'cpu', 'mem' or 'both'
+        self.profile_dir = profile_dir  # directory for the profiles of every phase
+        self.profile_top = profile_top  # number of functions and allocations listed in the reports
+        self.history = history  # record the availabilities of every run in an SQLite database
+        self.history_retention = history_retention  # days the history is kept, 0 keeps it forever
+        self.locations = locations  # only copies at these branches are kept when parsing records, empty keeps all
 
 
 def retrieve_options() -> Options:
-    list_name = __get_str_option("BH_LIST_NAME", "Merkliste")
+    list_names = __get_list_option("BH_LIST_NAME", ["Merkliste"])
     cache_cookies = __get_bool_option("BH_CACHE_COOKIES", False)
     headless = __get_bool_option("BH_HEADLESS", True)
     retries = __get_int_option("BH_RETRIES", 1)
-    workers = __get_int_option("BH_WORKERS", 3)
+    workers = max(__get_int_option("BH_WORKERS", 3), 1)
+    max_workers = max(__get_int_option("BH_MAX_WORKERS", 12), workers)
     raw_video_dir = __get_optional_str_option("BH_VIDEO_DIR")
-    video_dir = __resolve_video_dir(raw_video_dir) if raw_video_dir else None
+    video_dir = __resolve_writable_dir(raw_video_dir) if raw_video_dir else None
+    fetch_engine = __get_choice_option("BH_FETCH_ENGINE", FETCH_ENGINES, "threads")
+    async_concurrency = __get_int_option("BH_ASYNC_CONCURRENCY", 32)
+    record_cache = __get_bool_option("BH_RECORD_CACHE", False)
+    record_cache_ttl = __get_int_option("BH_RECORD_CACHE_TTL", 60 * 60)
+    record_cache_size = __get_int_option("BH_RECORD_CACHE_SIZE", 5000)
+    refresh_scheduler = __get_bool_option("BH_REFRESH_SCHEDULER", False)
+    fetch_budget = __get_int_option("BH_FETCH_BUDGET", 0)
+    max_staleness = __get_int_option("BH_MAX_STALENESS", 24 * 60 * 60)
+    hot_locations = __get_int_option("BH_HOT_LOCATIONS", 3)
+    interception_mode = __get_choice_option("BH_INTERCEPT", INTERCEPTION_MODES, "off")
+    pipeline = __get_bool_option("BH_PIPELINE", False)
+    capture_dir = __get_optional_str_option("BH_CAPTURE_DIR")
+    replay_file = __get_optional_str_option("BH_REPLAY_FILE")
+    if capture_dir and replay_file:
+        raise ValueError("BH_CAPTURE_DIR and BH_REPLAY_FILE cannot be used together")
+    output_mode = __get_choice_option("BH_OUTPUT_MODE", OUTPUT_MODES, "single")
+    precompress = __get_bool_option("BH_PRECOMPRESS", False)
+    serve_host = __get_str_option("BH_SERVE_HOST", "127.0.0.1")
+    serve_port = __get_int_option("BH_SERVE_PORT", 8080)
+    serve_interval = max(__get_int_option("BH_SERVE_INTERVAL", 15 * 60), 1)
+    serve_jitter = min(max(__get_int_option("BH_SERVE_JITTER", 60), 0), serve_interval - 1)
+    deadline = max(__get_int_option("BH_DEADLINE", 0), 0)
+    connect_timeout = __get_float_option("BH_CONNECT_TIMEOUT", 10.0)
+    read_timeout = __get_float_option("BH_READ_TIMEOUT", 30.0)
+    hedge = __get_bool_option("BH_HEDGE", False)
+    degraded = __get_bool_option("BH_DEGRADED", False)
+    max_failed_share = min(max(__get_float_option("BH_MAX_FAILED_SHARE", 0.1), 0.0), 1.0)
+    metrics_file = __get_str_option("BH_METRICS_FILE", METRICS_FILE) or None
+    prometheus_file = __get_optional_str_option("BH_PROMETHEUS_FILE")
+    profile = __get_choice_option("BH_PROFILE", PROFILE_MODES, "off")
+    raw_profile_dir = __get_str_option("BH_PROFILE_DIR", "profiles")
+    profile_dir = __resolve_writable_dir(raw_profile_dir) if profile != "off" else raw_profile_dir
+    profile_top = max(__get_int_option("BH_PROFILE_TOP", 25), 1)
+    history = __get_bool_option("BH_HISTORY", False)
+    history_retention = max(__get_int_option("BH_HISTORY_RETENTION", 180), 0)
+    locations = __get_list_option("BH_LOCATIONS", [])
     return Options(
-        list_name=list_name,
+        list_names=list_names,
         cache_cookies=cache_cookies,
         headless=headless,
         retries=retries,
         workers=workers,
+        max_workers=max_workers,
         video_dir=video_dir,
+        fetch_engine=fetch_engine,
+        async_concurrency=async_concurrency,
+        record_cache=record_cache,
+        record_cache_ttl=record_cache_ttl,
+        record_cache_size=record_cache_size,
+        refresh_scheduler=refresh_scheduler,
+        fetch_budget=fetch_budget,
+        max_staleness=max_staleness,
+        hot_locations=hot_locations,
+        interception_mode=interception_mode,
+        pipeline=pipeline,
+        capture_dir=capture_dir,
+        replay_file=replay_file,
+        output_mode=output_mode,
+        precompress=precompress,
+        serve_host=serve_host,
+        serve_port=serve_port,
+        serve_interval=serve_interval,
+        serve_jitter=serve_jitter,
+        deadline=deadline,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        hedge=hedge,
+        degraded=degraded,
+        max_failed_share=max_failed_share,
+        metrics_file=metrics_file,
+        prometheus_file=prometheus_file,
+        profile=profile,
+        profile_dir=profile_dir,
+        profile_top=profile_top,
+        history=history,
+        history_retention=history_retention,
+        locations=locations,
     )
 
 
@@ -45,6 +191,14 @@ def __get_str_option(env_name: str, default: str) -> str:
     return value
 
 
+def __get_list_option(env_name: str, default: list[str]) -> list[str]:
+    value = os.getenv(env_name)
+    if value is None:
+        return default
+    values = [entry.strip() for entry in value.split(",") if entry.strip()]
+    return values if values else default
+
+
 def __get_bool_option(env_name: str, default: bool) -> bool:
     value = os.getenv(env_name)
     if value is None:
@@ -62,12 +216,29 @@ def __get_int_option(env_name: str, default: int) -> int:
         return default
 
 
+def __get_float_option(env_name: str, default: float) -> float:
+    value = os.getenv(env_name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def __get_choice_option(env_name: str, choices: tuple[str, ...], default: str) -> str:
+    value = __get_str_option(env_name, default).strip().lower()
+    if value not in choices:
+        raise ValueError(f"Invalid value '{value}' for {env_name}, expected one of: {', '.join(choices)}")
+    return value
+
+
 def __get_optional_str_option(env_name: str) -> Optional[str]:
     value = __get_str_option(env_name, "").strip()
     return value if value else None
 
 
-def __resolve_video_dir(value: str) -> str:
+def __resolve_writable_dir(value: str) -> str:
     if os.path.isdir(value):
         if not os.access(value, os.W_OK):
             raise ValueError(f"Directory '{value}' is not writable")
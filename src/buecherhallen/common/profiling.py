@@ -0,0 +1,139 @@
+import contextlib
+import io
+import logging
+import os
+import threading
+from typing import Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+log = logging.getLogger(__name__)
+
+PROFILE_MODES = ("off", "cpu", "mem", "both")
+
+# allocations of the profiling machinery itself are not interesting
+IGNORED_ALLOCATION_FILES = (
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    "<unknown>",
+)
+
+
+class PhaseProfiler:
+    """Opt-in CPU and memory profiling of the outermost phases timed by the run metrics."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__cpu = False
+        self.__mem = False
+        self.__directory = ""
+        self.__top = 0
+        self.__active: Optional[str] = None
+        self.__sequence = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.__cpu or self.__mem
+
+    def configure(self, mode: str, directory: str, top: int):
+        self.__cpu = mode in ("cpu", "both")
+        self.__mem = mode in ("mem", "both")
+        self.__directory = directory
+        self.__top = top
+        if not self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        if self.__mem:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        log.info(f"Profiling phases ({mode}) into {directory}")
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        with self.__lock:
+            if self.__active is not None:
+                nested = True
+            else:
+                nested = False
+                self.__active = name
+                self.__sequence += 1
+                prefix = os.path.join(self.__directory, f"{self.__sequence:03d}-{name}")
+        if nested:
+            yield
+            return
+
+        try:
+            with self.__profile_cpu(prefix), self.__profile_mem(name, prefix):
+                yield
+        finally:
+            with self.__lock:
+                self.__active = None
+
+    @contextlib.contextmanager
+    def __profile_cpu(self, prefix: str) -> Iterator[None]:
+        if not self.__cpu:
+            yield
+            return
+        import cProfile
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            log.warning(f"Cannot profile {prefix}: {e}")
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.__write_cpu_report(profiler, prefix)
+
+    @contextlib.contextmanager
+    def __profile_mem(self, name: str, prefix: str) -> Iterator[None]:
+        if not self.__mem:
+            yield
+            return
+        import tracemalloc
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        filters += [tracemalloc.Filter(False, file) for file in IGNORED_ALLOCATION_FILES]
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+            self.__write_mem_report(name, before, after, peak, prefix)
+
+    def __write_cpu_report(self, profiler: 'cProfile.Profile', prefix: str):
+        import pstats
+
+        profiler.dump_stats(f"{prefix}.prof")
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.__top)
+        with open(f"{prefix}-cpu.txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        log.info(f"Wrote CPU profile {prefix}.prof")
+
+    def __write_mem_report(self, name: str, before: 'tracemalloc.Snapshot', after: 'tracemalloc.Snapshot', peak: int,
+                           prefix: str):
+        differences = after.compare_to(before, "lineno")
+        retained = sum(difference.size_diff for difference in differences)
+        lines = [f"Phase {name}: peak {peak / 2 ** 20:.1f} MiB traced, {retained / 2 ** 20:+.1f} MiB retained",
+                 f"Top {self.__top} allocations by retained size:"]
+        lines += [str(difference) for difference in differences[:self.__top]]
+        with open(f"{prefix}-mem.txt", "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        log.info(f"Wrote memory profile {prefix}-mem.txt")
+
+
+PROFILER = PhaseProfiler()
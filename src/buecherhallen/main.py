@@ -3,6 +3,7 @@ import os
 import sys
 
 import buecherhallen.app as app
+import buecherhallen.serve.daemon as daemon
 from buecherhallen.log.custom_formatter import CustomFormatter
 
 log_level = os.environ.get('BH_LOG_LEVEL', 'WARN')
@@ -18,8 +19,18 @@ log.handlers.clear()
 log.addHandler(handler)
 
 
+COMMANDS = {
+    "run": app.run,
+    "serve": daemon.serve,
+}
+
+
 def main():
-    app.run()
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    if command not in COMMANDS:
+        print(f"Usage: buecherhallen [{'|'.join(COMMANDS)}]", file=sys.stderr)
+        exit(2)
+    COMMANDS[command]()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Optional
+
+from buecherhallen.api.deadline import DeadlineExceeded
+from buecherhallen.api.rate_control import AdaptiveConcurrency, AsyncConcurrencyGate, retry_after_seconds
+from buecherhallen.api.session import ApiSession
+from buecherhallen.common.constants import SOLUS_APP_ID
+from buecherhallen.common.metrics import METRICS
+from buecherhallen.media.item import Item, ItemParseError
+from buecherhallen.media.list_item import ListItem
+from buecherhallen.media.record_cache import RecordCache
+
+log = logging.getLogger(__name__)
+
+
+def retrieve_items_async(list_items: list[ListItem], retries: int, max_connections: int, session: ApiSession,
+                         cache: Optional[RecordCache] = None, tolerate_failures: bool = False) -> list[Optional[Item]]:
+    """Fetches and parses all records on an asyncio event loop over HTTP/2."""
+    return asyncio.run(__retrieve_items(list_items, retries, max_connections, session, cache, tolerate_failures))
+
+
+async def __retrieve_items(list_items: list[ListItem], retries: int, max_connections: int, session: ApiSession,
+                           cache: Optional[RecordCache], tolerate_failures: bool) -> list[Optional[Item]]:
+    try:
+        import httpx
+    except ImportError as e:
+        raise ItemParseError("The async fetch engine requires the 'http2' extra (httpx[http2])") from e
+
+    limits = httpx.Limits(max_connections=max(max_connections, 1), max_keepalive_connections=max(max_connections, 1))
+    gate = AsyncConcurrencyGate(session.rate_controller)
+    http_versions: dict[str, int] = {}
+
+    async with httpx.AsyncClient(http2=True, limits=limits, headers={'Solus-App-Id': SOLUS_APP_ID}) as client:
+        async def fetch(list_item: ListItem) -> Optional[Item]:
+            raw_item = cache.lookup_fresh(list_item) if cache else None
+            if raw_item is None:
+                try:
+                    raw_item = await __retrieve_raw_item_details(client, list_item, retries, cache, http_versions,
+                                                                 session, gate)
+                except (ItemParseError, DeadlineExceeded, httpx.HTTPError) as e:
+                    if not tolerate_failures:
+                        raise
+                    log.error(f"Failed to fetch record {list_item.item_id}, continuing without it: {e!r}")
+                    return None
+            return Item.from_json(raw_item)
+
+        items = await asyncio.gather(*(fetch(list_item) for list_item in list_items))
+
+    log.info(f"Async engine fetched {len(items)} records, responses by HTTP version: {http_versions}")
+    return list(items)
+
+
+async def __retrieve_raw_item_details(client, list_item: ListItem, retries: int, cache: Optional[RecordCache],
+                                      http_versions: dict[str, int], session: ApiSession,
+                                      gate: AsyncConcurrencyGate) -> dict[str, Any]:
+    import httpx
+
+    rate_controller = session.rate_controller
+    item_id = list_item.item_id
+    attempt = 0
+    while True:
+        log.info(f"Fetching record with ID: {item_id}")
+        headers = cache.conditional_headers(list_item) if cache else {}
+        try:
+            if session.hedger:
+                response = await session.hedger.call_async(
+                    lambda on_start: __send(client, list_item, headers, session, rate_controller, gate, on_start))
+            else:
+                response = await __send(client, list_item, headers, session, rate_controller, gate)
+        except httpx.HTTPError as e:
+            log.error(f"Error fetching record {item_id}: {e!r}")
+            if attempt >= retries:
+                raise ItemParseError(f"Failed to fetch record {item_id}: {e!r}") from e
+            attempt = await __back_off(session, item_id, attempt, retries, None)
+            continue
+        http_versions[response.http_version] = http_versions.get(response.http_version, 0) + 1
+
+        status_code = response.status_code
+        log.debug(f"Records API response status code: {status_code}")
+        if status_code == 304 and cache:
+            cached_payload = cache.record_not_modified(list_item)
+            if cached_payload is not None:
+                return cached_payload
+            log.warning(f"Record {item_id} not modified but missing from cache, fetching again")
+            cache = None
+            continue
+
+        if response.is_success:
+            response_json = response.json()
+            if cache:
+                cache.record_fetched(list_item, response_json, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return response_json
+
+        log.error(f"Failed to fetch record {item_id}: {status_code}")
+        log.debug(f"Records API response content: {response.text}")
+        if attempt >= retries:
+            raise ItemParseError(f"Failed to fetch record {item_id}: status code {status_code}")
+        attempt = await __back_off(session, item_id, attempt, retries, retry_after_seconds(response.headers))
+
+
+async def __send(client, list_item: ListItem, headers: dict[str, str], session: ApiSession,
+                 rate_controller: AdaptiveConcurrency, gate: AsyncConcurrencyGate,
+                 on_start: Optional[Callable[[], None]] = None):
+    import httpx
+
+    session.deadline.check(f"fetching record {list_item.item_id}")
+    async with gate:
+        connect_timeout, read_timeout = session.request_timeout()
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        if on_start:
+            on_start()
+        start = time.monotonic()
+        try:
+            response = await client.get(list_item.get_record_api_url(), headers=headers, timeout=timeout)
+        except httpx.HTTPError:
+            rate_controller.on_error()
+            METRICS.observe_request("record", time.monotonic() - start, 0, error=True)
+            raise
+        latency = time.monotonic() - start
+        rate_controller.on_response(response.status_code, latency, retry_after_seconds(response.headers))
+        METRICS.observe_request("record", latency, len(response.content), error=response.status_code >= 400)
+        return response
+
+
+async def __back_off(session: ApiSession, item_id: str, attempt: int, retries: int,
+                     retry_after: Optional[float]) -> int:
+    delay = session.rate_controller.backoff_delay(attempt, retry_after)
+    if not session.deadline.fits(delay):
+        raise ItemParseError(f"No time left to retry record {item_id} in {delay:.1f}s")
+    log.warning(f"Retrying fetch for record {item_id} in {delay:.1f}s ({retries - attempt} left)")
+    METRICS.increment("record_retries")
+    await asyncio.sleep(delay)
+    return attempt + 1
@@ -0,0 +1,261 @@
+import logging
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from buecherhallen.media.item import Item
+from buecherhallen.media.locations import LOCATIONS
+
+log = logging.getLogger(__name__)
+
+HISTORY_SCHEMA_VERSION = 1
+
+HISTORY_SCHEMA = """
+CREATE TABLE runs (
+    run_id INTEGER PRIMARY KEY,
+    observed_at REAL NOT NULL
+);
+CREATE TABLE locations (
+    location_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+-- current state of every item at every location, one row each
+CREATE TABLE latest (
+    item_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    location_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    max_count INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    PRIMARY KEY (item_id, source, location_id)
+) WITHOUT ROWID;
+-- every change of the state, a location an item is no longer at is recorded as 0 of 0 copies
+CREATE TABLE observations (
+    item_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    location_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    max_count INTEGER NOT NULL,
+    PRIMARY KEY (item_id, source, location_id, run_id)
+) WITHOUT ROWID;
+CREATE INDEX observations_by_location ON observations (location_id, run_id);
+"""
+
+# first run of the current availability streak of every item at every location: the first run with copies after the
+# last one without, kept if there was such a run or the item was observed before at other locations, the history
+# cannot tell since when an item has been available if it was available from its first run on
+AVAILABLE_SINCE_QUERY = """
+WITH run_observations AS (
+    SELECT o.* FROM observations o JOIN run_items USING (item_id, source)
+), first_runs AS (
+    SELECT item_id, source, MIN(run_id) AS run_id FROM run_observations GROUP BY item_id, source
+), last_unavailable AS (
+    SELECT item_id, source, location_id, MAX(run_id) AS run_id FROM run_observations WHERE count = 0
+    GROUP BY item_id, source, location_id
+)
+SELECT o.item_id, o.source, l.name, MIN(r.observed_at)
+FROM run_observations o
+JOIN first_runs f ON f.item_id = o.item_id AND f.source = o.source
+LEFT JOIN last_unavailable u ON u.item_id = o.item_id AND u.source = o.source AND u.location_id = o.location_id
+JOIN runs r ON r.run_id = o.run_id
+JOIN locations l ON l.location_id = o.location_id
+WHERE o.count > 0 AND o.run_id > COALESCE(u.run_id, 0)
+GROUP BY o.item_id, o.source, o.location_id
+HAVING MIN(o.run_id) > MIN(f.run_id) OR MAX(u.run_id) IS NOT NULL
+"""
+
+# (count, max_count) of an item at one location
+State = tuple[int, int]
+
+
+class HistoryError(Exception):
+    pass
+
+
+class HistoryUpdate(NamedTuple):
+    run_id: int
+    changes: int
+    # locations at which an item had no copy available in the previous run and has one now
+    became_available: int
+
+
+class HistoryEntry(NamedTuple):
+    observed_at: float
+    item_id: str
+    source: str
+    count: int
+    max_count: int
+
+
+class HistoryStore:
+    """Availability history in an SQLite database, every run only writes the changes to the latest state."""
+
+    def __init__(self, path: str, retention_days: int):
+        # only imported if the history is enabled
+        import sqlite3
+
+        self.path = path
+        self.retention_seconds = retention_days * 24 * 60 * 60
+        # serve mode records from its refresh thread, one at a time
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute("PRAGMA synchronous = NORMAL")
+        self.__location_ids: dict[str, int] = {}
+        self.__migrate()
+
+    def __enter__(self) -> 'HistoryStore':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record_run(self, items: Iterable[Item], observed_at: Optional[float] = None) -> HistoryUpdate:
+        """Records the availabilities of the given items, stale copies of items that failed are left out."""
+        observed_at = observed_at if observed_at is not None else time.time()
+        try:
+            update = self.__record_run(items, observed_at)
+        except Exception:
+            # locations added in the rolled back transaction do not exist
+            self.__location_ids.clear()
+            raise
+        # frees the pages of pruned rows, outside of the transaction, every row of the result is one page
+        self.__connection.execute("PRAGMA incremental_vacuum").fetchall()
+
+        log.info(f"Recorded run {update.run_id} in history: {update.changes} changes, "
+                 f"{update.became_available} newly available")
+        return update
+
+    def __record_run(self, items: Iterable[Item], observed_at: float) -> HistoryUpdate:
+        with self.__connection:
+            run_id = self.__connection.execute("INSERT INTO runs (observed_at) VALUES (?)", (observed_at,)).lastrowid
+
+            observed: dict[tuple[str, str, int], State] = {}
+            observed_items: set[tuple[str, str]] = set()
+            for item in items:
+                if item.stale_since is not None:
+                    continue
+                observed_items.add((item.item_id, item.source))
+                for location, availability in item.availabilities.items():
+                    key = (item.item_id, item.source, self.__location_id(location))
+                    observed[key] = (availability.count, availability.max_count)
+            latest = self.__latest_rows(observed_items)
+
+            changed = [(*key, run_id, *state) for key, state in observed.items() if latest.get(key) != state]
+            # branches left out by the location filter are not observed, but have not disappeared either
+            filtered_out = self.__filtered_out_location_ids()
+            gone = [key for key in latest if key[:2] in observed_items and key not in observed
+                    and key[2] not in filtered_out]
+            became_available = sum(1 for key, state in observed.items()
+                                   if state[0] > 0 and latest.get(key, (0, 0))[0] == 0)
+
+            self.__connection.executemany(
+                "INSERT INTO observations (item_id, source, location_id, run_id, count, max_count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                changed + [(*key, run_id, 0, 0) for key in gone])
+            self.__connection.executemany(
+                "INSERT INTO latest (item_id, source, location_id, run_id, count, max_count) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (item_id, source, location_id) "
+                "DO UPDATE SET count = excluded.count, max_count = excluded.max_count, run_id = excluded.run_id",
+                changed)
+            self.__connection.executemany(
+                "DELETE FROM latest WHERE item_id = ? AND source = ? AND location_id = ?", gone)
+            self.__prune(observed_at)
+        return HistoryUpdate(run_id, len(changed) + len(gone), became_available)
+
+    def latest_state(self, item_id: str, source: str) -> dict[str, State]:
+        """Returns the latest `(count, max_count)` of the item by location name."""
+        rows = self.__connection.execute(
+            "SELECT l.name, s.count, s.max_count FROM latest s JOIN locations l USING (location_id) "
+            "WHERE s.item_id = ? AND s.source = ?", (item_id, source))
+        return {name: (count, max_count) for name, count, max_count in rows}
+
+    def latest_states(self) -> dict[tuple[str, str], dict[str, State]]:
+        """Returns the latest state of every item, keyed by `(item_id, source)`."""
+        states: dict[tuple[str, str], dict[str, State]] = {}
+        rows = self.__connection.execute(
+            "SELECT s.item_id, s.source, l.name, s.count, s.max_count FROM latest s JOIN locations l USING (location_id)")
+        for item_id, source, name, count, max_count in rows:
+            states.setdefault((item_id, source), {})[name] = (count, max_count)
+        return states
+
+    def available_since(self, item_keys: Iterable[tuple[str, str]]) -> dict[tuple[str, str], dict[str, float]]:
+        """Returns since when the items have had copies at the locations they had none at before, by location name."""
+        with self.__connection:
+            self.__set_run_items(item_keys)
+            rows = self.__connection.execute(AVAILABLE_SINCE_QUERY).fetchall()
+        available_since: dict[tuple[str, str], dict[str, float]] = {}
+        for item_id, source, name, observed_at in rows:
+            available_since.setdefault((item_id, source), {})[name] = observed_at
+        return available_since
+
+    def location_history(self, location: str, since: float = 0.0) -> list[HistoryEntry]:
+        """Returns every change at one location since the given time, oldest first."""
+        rows = self.__connection.execute(
+            "SELECT r.observed_at, o.item_id, o.source, o.count, o.max_count FROM observations o "
+            "JOIN runs r USING (run_id) JOIN locations l USING (location_id) "
+            "WHERE l.name = ? AND r.observed_at >= ? ORDER BY o.run_id", (location, since))
+        return [HistoryEntry(*row) for row in rows]
+
+    def close(self):
+        self.__connection.close()
+
+    def __migrate(self):
+        version = self.__connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == HISTORY_SCHEMA_VERSION:
+            return
+        if version != 0:
+            raise HistoryError(f"History {self.path} has schema version {version}, "
+                               f"expected {HISTORY_SCHEMA_VERSION}")
+        log.info(f"Creating history {self.path}")
+        # only takes effect before the first table is created
+        self.__connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        with self.__connection:
+            self.__connection.executescript(HISTORY_SCHEMA)
+            self.__connection.execute(f"PRAGMA user_version = {HISTORY_SCHEMA_VERSION}")
+
+    def __set_run_items(self, item_keys: Iterable[tuple[str, str]]):
+        # queries join this temporary table, the history of a long list is not loaded for a short run
+        self.__connection.execute("CREATE TEMP TABLE IF NOT EXISTS run_items (item_id TEXT NOT NULL, "
+                                  "source TEXT NOT NULL, PRIMARY KEY (item_id, source)) WITHOUT ROWID")
+        self.__connection.execute("DELETE FROM run_items")
+        self.__connection.executemany("INSERT OR IGNORE INTO run_items (item_id, source) VALUES (?, ?)", item_keys)
+
+    def __latest_rows(self, item_keys: set[tuple[str, str]]) -> dict[tuple[str, str, int], State]:
+        self.__set_run_items(item_keys)
+        rows = self.__connection.execute("SELECT s.item_id, s.source, s.location_id, s.count, s.max_count "
+                                         "FROM latest s JOIN run_items USING (item_id, source)")
+        return {(item_id, source, location_id): (count, max_count)
+                for item_id, source, location_id, count, max_count in rows}
+
+    def __filtered_out_location_ids(self) -> set[int]:
+        if not LOCATIONS.filtered:
+            return set()
+        rows = self.__connection.execute("SELECT location_id, name FROM locations")
+        return {location_id for location_id, name in rows if not LOCATIONS.is_preferred(name)}
+
+    def __location_id(self, name: str) -> int:
+        location_id = self.__location_ids.get(name)
+        if location_id is None:
+            self.__connection.execute("INSERT OR IGNORE INTO locations (name) VALUES (?)", (name,))
+            location_id = self.__connection.execute(
+                "SELECT location_id FROM locations WHERE name = ?", (name,)).fetchone()[0]
+            self.__location_ids[name] = location_id
+        return location_id
+
+    def __prune(self, now: float):
+        if not self.retention_seconds:
+            return
+        cutoff = now - self.retention_seconds
+        # the latest state keeps its rows, only the history before the cutoff goes
+        self.__connection.execute(
+            "DELETE FROM observations WHERE run_id IN (SELECT run_id FROM runs WHERE observed_at < ?)", (cutoff,))
+        self.__connection.execute(
+            "DELETE FROM runs WHERE observed_at < ? AND run_id NOT IN (SELECT run_id FROM latest)", (cutoff,))
+
+
+def open_history(path: str, retention_days: int) -> HistoryStore:
+    import sqlite3
+
+    try:
+        return HistoryStore(path, retention_days)
+    except sqlite3.Error as e:
+        raise HistoryError(f"Failed to open history {path}: {e}") from e
@@ -1,16 +1,24 @@
 import json
 import logging
+import time
 from typing import Any, Optional
 
 import requests
 
-from buecherhallen.common.constants import BASE_URL, SOLUS_APP_ID
+from buecherhallen.api.rate_control import retry_after_seconds
+from buecherhallen.api.session import ApiSession
+from buecherhallen.common.constants import BASE_URL
+from buecherhallen.common.metrics import METRICS
 from buecherhallen.media.list_item import ListItem
+from buecherhallen.media.locations import LOCATIONS, DIGITAL_LOCATION
+from buecherhallen.media.record_cache import RecordCache
 
 log = logging.getLogger(__name__)
 
 
 class Availability:
+    __slots__ = ("location", "count", "max_count", "shelf")
+
     def __init__(self, location: str, count: int, max_count: int, shelf: str):
         self.location = location
         self.count = count
@@ -25,24 +33,86 @@ class Availability:
 
 
 class Availabilities:
-    def __init__(self, availabilities: list[Availability]):
-        self.availabilities: dict[str, Availability] = \
-            {availability.location: availability for availability in availabilities}
+    """Availability of an item per location, stored as small integer columns indexed by location ID."""
+
+    __slots__ = ("__location_ids", "__counts", "__shelves", "__other_counts")
+
+    def __init__(self, location_ids: tuple[int, ...], counts: tuple[int, ...], shelves: Optional[dict[int, str]] = None,
+                 other_counts: Optional[tuple[int, int]] = None):
+        self.__location_ids = location_ids
+        # interleaved (count, max_count) per location
+        self.__counts = counts
+        # 'shelf' is almost always empty, so only non-empty values are stored
+        self.__shelves = shelves or None
+        self.__other_counts = other_counts or None
+
+    @staticmethod
+    def of(availabilities: list[Availability], other_counts: Optional[tuple[int, int]] = None) -> 'Availabilities':
+        location_ids = tuple(LOCATIONS.id_for(availability.location) for availability in availabilities)
+        counts = tuple(count for availability in availabilities for count in (availability.count, availability.max_count))
+        shelves = {location_id: availability.shelf
+                   for location_id, availability in zip(location_ids, availabilities) if availability.shelf}
+        return Availabilities(location_ids, counts, shelves, other_counts)
+
+    @property
+    def other_counts(self) -> tuple[int, int]:
+        """Returns (count, max_count) summed over the locations that were filtered out."""
+        return self.__other_counts or (0, 0)
+
+    def __index(self, location: str) -> int:
+        location_id = LOCATIONS.find_id(location)
+        if location_id is None:
+            raise KeyError(location)
+        try:
+            return self.__location_ids.index(location_id)
+        except ValueError:
+            raise KeyError(location) from None
+
+    def __availability(self, index: int) -> Availability:
+        location_id = self.__location_ids[index]
+        shelf = self.__shelves.get(location_id, "") if self.__shelves else ""
+        return Availability(LOCATIONS.name(location_id), self.__counts[2 * index], self.__counts[2 * index + 1], shelf)
 
     def is_available(self, location: str) -> bool:
-        return self.availabilities[location].is_available()
+        return self.__counts[2 * self.__index(location)] > 0
 
     def __getitem__(self, location: str) -> Availability:
-        return self.availabilities[location]
+        return self.__availability(self.__index(location))
+
+    def __contains__(self, location: str) -> bool:
+        location_id = LOCATIONS.find_id(location)
+        return location_id is not None and location_id in self.__location_ids
+
+    def __len__(self) -> int:
+        return len(self.__location_ids)
 
     def items(self) -> list[tuple[str, Availability]]:
-        return list(self.availabilities.items())
+        return [(LOCATIONS.name(location_id), self.__availability(index))
+                for index, location_id in enumerate(self.__location_ids)]
+
+    def available_locations(self) -> list[str]:
+        counts = self.__counts
+        return [LOCATIONS.name(location_id) for index, location_id in enumerate(self.__location_ids)
+                if counts[2 * index] > 0]
+
+    def available(self) -> list[tuple[str, Availability]]:
+        """Like `items`, for the locations with an available copy only."""
+        counts = self.__counts
+        return [(LOCATIONS.name(location_id), self.__availability(index))
+                for index, location_id in enumerate(self.__location_ids) if counts[2 * index] > 0]
+
+    @property
+    def availabilities(self) -> dict[str, Availability]:
+        return dict(self.items())
 
     def __repr__(self):
         return f"Availabilities({self.availabilities})"
 
 
 class Item:
+    __slots__ = ("item_id", "source", "title", "author", "format", "genre", "signature", "availabilities",
+                 "stale_since", "available_since")
+
     video_game_format_indicators = [
         "konsolenspiel",
         "nintendo switch",
@@ -55,7 +125,8 @@ class Item:
     ]
 
     def __init__(self, item_id: str, source: str, title: str, author: Optional[str], format: Optional[str],
-                 genre: Optional[str], signature: str, availabilities: Availabilities):
+                 genre: Optional[str], signature: str, availabilities: Availabilities,
+                 stale_since: Optional[float] = None):
         self.item_id = item_id
         self.source = source
         self.title = title
@@ -64,6 +135,10 @@ class Item:
         self.genre = genre
         self.signature = signature
         self.availabilities = availabilities
+        # time the data was fetched if it is a last-known-good copy that could not be refreshed
+        self.stale_since = stale_since
+        # time copies became available by location name, from the history if it is enabled
+        self.available_since: Optional[dict[str, float]] = None
 
     def is_available(self, location: str) -> bool:
         return self.availabilities.is_available(location)
@@ -122,70 +197,142 @@ class Item:
             if key == "Genre":
                 genre = metadata.get("usableValue", None)
 
-        copies = raw.get("copies", [])
-        availabilities_list = []
-        location_counts = {}
-
-        for copy in copies:
-            location_name = copy.get("location", {}).get("locationName", "Unknown Location")
-            available = copy.get("available", False)
-            if location_name not in location_counts:
+        # location ID -> [count, max_count, shelf]
+        location_counts: dict[int, list] = {}
+        other_count = 0
+        other_max_count = 0
+        # looked up once, so parsing without a filter does not pay for it per copy, and with one a copy at a known
+        # location costs a dict lookup instead of a call
+        preferred_by_name = LOCATIONS.preferred_by_name()
+
+        for copy in raw.get("copies", []):
+            location = copy.get("location", {}).get("locationName", "Unknown Location")
+            if preferred_by_name is not None:
+                preferred = preferred_by_name.get(location)
+                if preferred is None:
+                    preferred = LOCATIONS.is_preferred(location)
+                if not preferred:
+                    other_max_count += 1
+                    if copy.get("available", False):
+                        other_count += 1
+                    continue
+            location_id = LOCATIONS.id_for(location)
+            counts = location_counts.get(location_id)
+            if counts is None:
                 # 'shelf' seems to be always empty, maybe it will be used in the future
-                location_counts[location_name] = {"count": 0, "max_count": 0, "shelf": copy.get("shelf", "")}
-            location_counts[location_name]["max_count"] += 1
-            if available:
-                location_counts[location_name]["count"] += 1
+                counts = location_counts[location_id] = [0, 0, copy.get("shelf", "")]
+            counts[1] += 1
+            if copy.get("available", False):
+                counts[0] += 1
 
         digital_copies = raw.get("digitalCopies", [])
-        for copy in digital_copies:
-            location_name = "Digital"
-            available = copy.get("available", False)
-            count = copy.get("count", 1)
-            if location_name not in location_counts:
-                location_counts[location_name] = {"count": 0, "max_count": 0, "shelf": copy.get("shelf", "")}
-            location_counts[location_name]["max_count"] += count
-            if available:
-                location_counts[location_name]["count"] += count
+        if digital_copies:
+            location_id = LOCATIONS.id_for(DIGITAL_LOCATION)
+            for copy in digital_copies:
+                count = copy.get("count", 1)
+                counts = location_counts.get(location_id)
+                if counts is None:
+                    counts = location_counts[location_id] = [0, 0, copy.get("shelf", "")]
+                counts[1] += count
+                if copy.get("available", False):
+                    counts[0] += count
+
+        availabilities = Availabilities(
+            tuple(location_counts),
+            tuple(count for counts in location_counts.values() for count in counts[:2]),
+            {location_id: counts[2] for location_id, counts in location_counts.items() if counts[2]},
+            (other_count, other_max_count) if other_max_count else None,
+        )
 
-        for location, counts in location_counts.items():
-            availabilities_list.append(Availability(location, counts["count"], counts["max_count"], counts["shelf"]))
+        return Item(item_id, source, title, author, format, genre, signature, availabilities)
 
-        availabilities = Availabilities(availabilities_list)
+    def to_snapshot(self) -> dict[str, Any]:
+        return {
+            "item_id": self.item_id,
+            "source": self.source,
+            "title": self.title,
+            "author": self.author,
+            "format": self.format,
+            "genre": self.genre,
+            "signature": self.signature,
+            "availabilities": [[location, availability.count, availability.max_count, availability.shelf]
+                               for location, availability in self.availabilities.items()],
+            "other_counts": list(self.availabilities.other_counts),
+        }
 
-        return Item(item_id, source, title, author, format, genre, signature, availabilities)
+    @staticmethod
+    def from_snapshot(raw: dict[str, Any], stale_since: Optional[float] = None) -> 'Item':
+        other_count, other_max_count = raw.get("other_counts", (0, 0))
+        availabilities = Availabilities.of([Availability(location, count, max_count, shelf)
+                                            for location, count, max_count, shelf in raw["availabilities"]],
+                                           (other_count, other_max_count) if other_max_count else None)
+        return Item(raw["item_id"], raw["source"], raw["title"], raw.get("author"), raw.get("format"),
+                    raw.get("genre"), raw.get("signature", ""), availabilities, stale_since)
 
 
 class ItemParseError(Exception):
     pass
 
 
-def retrieve_item_details(list_item: ListItem, retries: int = 0) -> Item:
-    raw_item = __retrieve_raw_item_details(list_item, retries)
+def retrieve_item_details(session: ApiSession, list_item: ListItem, retries: int = 0,
+                          cache: Optional[RecordCache] = None) -> Item:
+    raw_item = cache.lookup_fresh(list_item) if cache else None
+    if raw_item is None:
+        raw_item = __retrieve_raw_item_details(session, list_item, retries, cache)
     item = Item.from_json(raw_item)
     print(item)
     return item
 
 
-def __retrieve_raw_item_details(list_item: ListItem, retries: int) -> dict[str, Any]:
+def __retrieve_raw_item_details(session: ApiSession, list_item: ListItem, retries: int,
+                                cache: Optional[RecordCache]) -> dict[str, Any]:
     item_id = list_item.item_id
-    log.info(f"Fetching record with ID: {item_id}")
-    api_url = f'{BASE_URL}/api/record?id={item_id}&source={list_item.source}'
-    response = requests.get(
-        api_url,
-        headers={'Solus-App-Id': SOLUS_APP_ID}
-    )
-
-    status_code = response.status_code
-    log.debug(f"Records API response status code: {status_code}")
-    if not response.ok:
+    attempt = 0
+    while True:
+        log.info(f"Fetching record with ID: {item_id}")
+        headers = cache.conditional_headers(list_item) if cache else {}
+        try:
+            response = session.get(list_item.get_record_api_url(), hedge=True, headers=headers)
+        except requests.RequestException as e:
+            log.error(f"Error fetching record {item_id}: {e}")
+            if attempt >= retries:
+                raise ItemParseError(f"Failed to fetch record {item_id}: {e}") from e
+            attempt = __back_off(session, item_id, attempt, retries, None)
+            continue
+
+        status_code = response.status_code
+        log.debug(f"Records API response status code: {status_code}")
+        if status_code == 304 and cache:
+            cached_payload = cache.record_not_modified(list_item)
+            if cached_payload is not None:
+                return cached_payload
+            log.warning(f"Record {item_id} not modified but missing from cache, fetching again")
+            cache = None
+            continue
+
+        if response.ok:
+            break
+
         log.error(f"Failed to fetch record {item_id}: {status_code}")
         log.debug(f"Records API response content: {response.text}")
-        if retries > 0:
-            log.warning(f"Retrying fetch for record {item_id} ({retries} left)")
-            return __retrieve_raw_item_details(list_item, retries - 1)
-        raise ItemParseError(f"Failed to fetch record {item_id}: status code {status_code}")
+        if attempt >= retries:
+            raise ItemParseError(f"Failed to fetch record {item_id}: status code {status_code}")
+        attempt = __back_off(session, item_id, attempt, retries, retry_after_seconds(response.headers))
 
     response_json = response.json()
     log.debug(f"Records API response JSON: {json.dumps(response_json, indent=2)}")
 
+    if cache:
+        cache.record_fetched(list_item, response_json, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
     return response_json
+
+
+def __back_off(session: ApiSession, item_id: str, attempt: int, retries: int, retry_after: Optional[float]) -> int:
+    delay = session.rate_controller.backoff_delay(attempt, retry_after)
+    if not session.deadline.fits(delay):
+        raise ItemParseError(f"No time left to retry record {item_id} in {delay:.1f}s")
+    log.warning(f"Retrying fetch for record {item_id} in {delay:.1f}s ({retries - attempt} left)")
+    METRICS.increment("record_retries")
+    time.sleep(delay)
+    return attempt + 1
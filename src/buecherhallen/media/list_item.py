@@ -4,6 +4,8 @@ from buecherhallen.common.constants import BASE_URL
 
 
 class ListItem:
+    __slots__ = ("item_id", "source", "title", "author")
+
     def __init__(self, item_id: str, source: str, title: str, author: Optional[str]):
         self.item_id = item_id
         self.source = source
@@ -16,6 +18,15 @@ class ListItem:
     def get_url(self) -> str:
         return f"{BASE_URL}/manifestations/{self.item_id}?source={self.source}"
 
+    def get_record_api_url(self) -> str:
+        return f"{BASE_URL}/api/record?id={self.item_id}&source={self.source}"
+
+    def to_json(self) -> dict[str, Any]:
+        additional_metadata = [{"key": "title", "value": self.title}]
+        if self.author is not None:
+            additional_metadata.append({"key": "author", "value": self.author})
+        return {"id": self.item_id, "source": self.source, "additionalMetaData": additional_metadata}
+
     @staticmethod
     def from_json(raw: dict[str, Any]) -> 'ListItem':
         item_id = raw.get("id")
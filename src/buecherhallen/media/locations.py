@@ -0,0 +1,62 @@
+import sys
+import threading
+from typing import Iterable, Optional
+
+# digital copies are not at a branch, they are kept by every location filter
+DIGITAL_LOCATION = "Digital"
+
+
+class LocationTable:
+    """Interned table of location names shared by all items."""
+
+    def __init__(self):
+        self.__ids: dict[str, int] = {}
+        self.__names: list[str] = []
+        self.__lock = threading.Lock()
+        # case-folded names of the preferred locations, None keeps all locations
+        self.__preferred: Optional[frozenset[str]] = None
+        self.__is_preferred: dict[str, bool] = {DIGITAL_LOCATION: True}
+
+    def set_preferred(self, names: Optional[Iterable[str]]):
+        self.__preferred = frozenset(name.casefold() for name in names) if names else None
+        self.__is_preferred = {DIGITAL_LOCATION: True}
+
+    @property
+    def filtered(self) -> bool:
+        return self.__preferred is not None
+
+    def preferred_by_name(self) -> Optional[dict[str, bool]]:
+        """Returns the decisions of `is_preferred` made so far, None without a filter, for lookups in hot loops."""
+        return self.__is_preferred if self.__preferred is not None else None
+
+    def is_preferred(self, name: str) -> bool:
+        if self.__preferred is None:
+            return True
+        preferred = self.__is_preferred.get(name)
+        if preferred is None:
+            preferred = self.__is_preferred[name] = name.casefold() in self.__preferred
+        return preferred
+
+    def id_for(self, name: str) -> int:
+        location_id = self.__ids.get(name)
+        if location_id is not None:
+            return location_id
+        with self.__lock:
+            location_id = self.__ids.get(name)
+            if location_id is None:
+                location_id = len(self.__names)
+                self.__names.append(sys.intern(name))
+                self.__ids[self.__names[location_id]] = location_id
+            return location_id
+
+    def find_id(self, name: str) -> int | None:
+        return self.__ids.get(name)
+
+    def name(self, location_id: int) -> str:
+        return self.__names[location_id]
+
+    def __len__(self) -> int:
+        return len(self.__names)
+
+
+LOCATIONS = LocationTable()
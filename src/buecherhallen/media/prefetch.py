@@ -0,0 +1,54 @@
+import concurrent.futures
+import logging
+from typing import Callable
+
+from buecherhallen.media.item import Item
+from buecherhallen.media.list_item import ListItem
+
+log = logging.getLogger(__name__)
+
+
+class RecordPrefetcher:
+    """Schedules record fetches on an executor and hands out the results in watchlist order."""
+
+    def __init__(self, executor: concurrent.futures.Executor, fetch: Callable[[ListItem], Item]):
+        self.__executor = executor
+        self.__fetch = fetch
+        self.__futures: dict[tuple[str, str], concurrent.futures.Future] = {}
+
+    @staticmethod
+    def key(list_item: ListItem) -> tuple[str, str]:
+        return list_item.item_id, list_item.source
+
+    def prefetched(self) -> set[tuple[str, str]]:
+        return set(self.__futures)
+
+    def prefetch(self, list_items: list[ListItem]):
+        log.info(f"Prefetching {len(list_items)} records")
+        for list_item in list_items:
+            self.__submit(list_item)
+
+    def collect(self, list_items: list[ListItem]) -> list[Item]:
+        wanted = {RecordPrefetcher.key(list_item) for list_item in list_items}
+        prefetched = len(wanted & self.__futures.keys())
+        removed = [key for key in self.__futures if key not in wanted]
+        for key in removed:
+            future = self.__futures.pop(key)
+            future.cancel()
+        if prefetched or removed:
+            log.info(f"Prefetched {prefetched} of {len(list_items)} records, dropped {len(removed)} removed records")
+
+        futures = [self.__submit(list_item) for list_item in list_items]
+        return [future.result() for future in futures]
+
+    def cancel(self):
+        for future in self.__futures.values():
+            future.cancel()
+
+    def __submit(self, list_item: ListItem) -> concurrent.futures.Future:
+        key = RecordPrefetcher.key(list_item)
+        future = self.__futures.get(key)
+        if future is None:
+            future = self.__executor.submit(self.__fetch, list_item)
+            self.__futures[key] = future
+        return future
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from buecherhallen.common.metrics import METRICS
+from buecherhallen.media.list_item import ListItem
+
+log = logging.getLogger(__name__)
+
+RECORD_CACHE_VERSION = 1
+
+
+class CachedRecord:
+    def __init__(self, payload: dict[str, Any], fetched_at: float, etag: Optional[str], last_modified: Optional[str],
+                 changed_at: Optional[float] = None):
+        self.payload = payload
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+        # last time the availability of the record was seen to change
+        self.changed_at = changed_at if changed_at is not None else fetched_at
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "payload": self.payload,
+            "fetched_at": self.fetched_at,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "changed_at": self.changed_at,
+        }
+
+    @staticmethod
+    def from_json(raw: dict[str, Any]) -> 'CachedRecord':
+        return CachedRecord(raw["payload"], raw["fetched_at"], raw.get("etag"), raw.get("last_modified"),
+                            raw.get("changed_at"))
+
+
+class RecordCache:
+    """Persistent cache of raw `/api/record` payloads keyed by `(item_id, source)`."""
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int, records: Optional[dict[str, CachedRecord]] = None):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.__records: dict[str, CachedRecord] = records or {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    @staticmethod
+    def key(list_item: ListItem) -> str:
+        return f"{list_item.source}/{list_item.item_id}"
+
+    def get(self, list_item: ListItem) -> Optional[CachedRecord]:
+        with self.__lock:
+            return self.__records.get(RecordCache.key(list_item))
+
+    def lookup_fresh(self, list_item: ListItem) -> Optional[dict[str, Any]]:
+        """Returns the cached payload if it is younger than the TTL, counting it as a hit."""
+        record = self.get(list_item)
+        if record is None or record.age() > self.ttl_seconds:
+            return None
+        with self.__lock:
+            self.hits += 1
+        log.debug(f"Record cache hit for {list_item.item_id}")
+        return record.payload
+
+    def lookup_snapshot(self, list_item: ListItem) -> Optional[dict[str, Any]]:
+        """Returns the cached payload regardless of its age, counting it as a hit."""
+        record = self.get(list_item)
+        if record is None:
+            return None
+        with self.__lock:
+            self.hits += 1
+        return record.payload
+
+    def conditional_headers(self, list_item: ListItem) -> dict[str, str]:
+        record = self.get(list_item)
+        headers = {}
+        if record is not None:
+            if record.etag:
+                headers['If-None-Match'] = record.etag
+            if record.last_modified:
+                headers['If-Modified-Since'] = record.last_modified
+        return headers
+
+    def record_not_modified(self, list_item: ListItem) -> Optional[dict[str, Any]]:
+        """Marks a cached record as revalidated by a 304 response and returns its payload."""
+        with self.__lock:
+            record = self.__records.get(RecordCache.key(list_item))
+            if record is None:
+                return None
+            record.fetched_at = time.time()
+            self.revalidated += 1
+        log.debug(f"Record cache revalidated {list_item.item_id}")
+        return record.payload
+
+    def record_fetched(self, list_item: ListItem, payload: dict[str, Any], etag: Optional[str], last_modified: Optional[str]):
+        now = time.time()
+        with self.__lock:
+            key = RecordCache.key(list_item)
+            previous = self.__records.get(key)
+            if previous is None:
+                changed_at = 0.0  # unknown, the record has not been seen before
+            elif availability_fingerprint(previous.payload) == availability_fingerprint(payload):
+                changed_at = previous.changed_at
+            else:
+                changed_at = now
+            self.__records[key] = CachedRecord(payload, now, etag, last_modified, changed_at)
+            self.misses += 1
+
+    def log_stats(self):
+        METRICS.increment("record_cache_hits", self.hits)
+        METRICS.increment("record_cache_misses", self.misses)
+        METRICS.increment("record_cache_revalidated", self.revalidated)
+        log.info(f"Record cache: {self.hits} hits, {self.misses} misses, {self.revalidated} revalidated")
+
+    def save(self):
+        with self.__lock:
+            records = sorted(self.__records.items(), key=lambda entry: entry[1].fetched_at, reverse=True)
+            evicted = len(records) - self.max_entries
+            if evicted > 0:
+                log.info(f"Evicting {evicted} records from record cache")
+                records = records[:self.max_entries]
+            self.__records = dict(records)
+            content = {
+                "version": RECORD_CACHE_VERSION,
+                "records": {key: record.to_json() for key, record in records},
+            }
+
+        log.info(f"Saving {len(records)} records to record cache {self.path}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def availability_fingerprint(payload: dict[str, Any]) -> list[tuple[str, bool]]:
+    """Returns a cheap, comparable summary of which copies of a raw record are available."""
+    fingerprint = [(copy.get("location", {}).get("locationName", ""), copy.get("available", False))
+                   for copy in payload.get("copies", [])]
+    fingerprint += [("Digital", copy.get("available", False)) for copy in payload.get("digitalCopies", [])]
+    return sorted(fingerprint)
+
+
+def load_record_cache(path: str, ttl_seconds: int, max_entries: int) -> RecordCache:
+    log.info(f"Loading record cache from {path}")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        log.info("No record cache found")
+        return RecordCache(path, ttl_seconds, max_entries)
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to read record cache, starting empty: {e}")
+        return RecordCache(path, ttl_seconds, max_entries)
+
+    if content.get("version") != RECORD_CACHE_VERSION:
+        log.info("Record cache has an incompatible version, starting empty")
+        return RecordCache(path, ttl_seconds, max_entries)
+
+    records = {key: CachedRecord.from_json(raw) for key, raw in content.get("records", {}).items()}
+    log.info(f"Loaded {len(records)} records from record cache")
+    return RecordCache(path, ttl_seconds, max_entries, records)
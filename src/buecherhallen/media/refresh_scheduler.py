@@ -0,0 +1,81 @@
+import logging
+import time
+from typing import Collection
+
+from buecherhallen.media.item import Item
+from buecherhallen.media.list_item import ListItem
+from buecherhallen.media.locations import DIGITAL_LOCATION
+from buecherhallen.media.record_cache import RecordCache, CachedRecord
+
+log = logging.getLogger(__name__)
+
+# refresh tiers, lower is more urgent
+TIER_MISSING = 0
+TIER_OVERDUE = 1
+TIER_HOT = 2
+TIER_WARM = 3
+TIER_COLD = 4
+
+
+class RefreshPlan:
+    def __init__(self, refresh: list[ListItem], from_snapshot: list[ListItem]):
+        self.refresh = refresh
+        self.from_snapshot = from_snapshot
+
+
+def plan_refresh(list_items: list[ListItem], cache: RecordCache, budget: int, max_staleness: int,
+                 hot_locations: int, prefetched: Collection[tuple[str, str]] = ()) -> RefreshPlan:
+    """Decides which records to refetch this run, based on the availability seen in the previous runs."""
+    now = time.time()
+    tiered: list[tuple[int, float, ListItem]] = []
+    for list_item in list_items:
+        record = cache.get(list_item)
+        tier = __tier(record, now, max_staleness, hot_locations)
+        age = now - record.fetched_at if record else float("inf")
+        tiered.append((tier, age, list_item))
+    tiered.sort(key=lambda entry: (__key(entry[2]) not in prefetched, entry[0], -entry[1]))
+
+    refresh: list[ListItem] = []
+    from_snapshot: list[ListItem] = []
+    optional_refreshes = 0
+    reused = 0
+    for tier, _, list_item in tiered:
+        if __key(list_item) in prefetched:
+            refresh.append(list_item)
+            reused += 1
+        elif tier in (TIER_MISSING, TIER_OVERDUE):
+            refresh.append(list_item)
+        elif tier != TIER_COLD and (budget <= 0 or optional_refreshes + reused < budget):
+            refresh.append(list_item)
+            optional_refreshes += 1
+        else:
+            from_snapshot.append(list_item)
+
+    mandatory = len(refresh) - optional_refreshes - reused
+    if 0 < budget < mandatory:
+        log.warning(f"{mandatory} records are missing or overdue, exceeding the fetch budget of {budget}")
+    log.info(f"Refresh plan: {len(refresh)} records to fetch ({mandatory} mandatory, {reused} prefetched), "
+             f"{len(from_snapshot)} served from snapshot")
+    return RefreshPlan(refresh, from_snapshot)
+
+
+def __key(list_item: ListItem) -> tuple[str, str]:
+    return list_item.item_id, list_item.source
+
+
+def __tier(record: CachedRecord | None, now: float, max_staleness: int, hot_locations: int) -> int:
+    if record is None:
+        return TIER_MISSING
+    if now - record.fetched_at > max_staleness:
+        return TIER_OVERDUE
+    if now - record.changed_at <= max_staleness:
+        return TIER_HOT
+
+    # with BH_LOCATIONS set, only the preferred branches count, the others are filtered out while parsing
+    available_locations = [location for location in Item.from_json(record.payload).availabilities.available_locations()
+                           if location != DIGITAL_LOCATION]
+    if len(available_locations) >= hot_locations:
+        return TIER_HOT
+    if available_locations:
+        return TIER_WARM
+    return TIER_COLD
@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Optional
+
+from buecherhallen.media.item import Item
+
+log = logging.getLogger(__name__)
+
+ITEM_SNAPSHOT_VERSION = 1
+
+
+class ItemSnapshot:
+    """Last-known-good copy of every item on the lists."""
+
+    def __init__(self, path: str, entries: Optional[dict[str, dict[str, Any]]] = None):
+        self.path = path
+        self.__entries: dict[str, dict[str, Any]] = entries or {}
+
+    @staticmethod
+    def key(item_id: str, source: str) -> str:
+        return f"{source}/{item_id}"
+
+    def lookup(self, item_id: str, source: str) -> Optional[Item]:
+        """Returns the last-known-good item, marked stale with the time it was fetched."""
+        entry = self.__entries.get(ItemSnapshot.key(item_id, source))
+        if entry is None:
+            return None
+        return Item.from_snapshot(entry["item"], entry["fetched_at"])
+
+    def update(self, item: Item, fetched_at: Optional[float] = None):
+        if item.stale_since is not None:
+            return
+        self.__entries[ItemSnapshot.key(item.item_id, item.source)] = {
+            "item": item.to_snapshot(),
+            "fetched_at": fetched_at if fetched_at is not None else time.time(),
+        }
+
+    def save(self, keys: list[tuple[str, str]]):
+        """Writes the entries of the items with the given `(item_id, source)` keys."""
+        entries = {}
+        for item_id, source in keys:
+            key = ItemSnapshot.key(item_id, source)
+            if key in self.__entries:
+                entries[key] = self.__entries[key]
+        self.__entries = entries
+
+        log.info(f"Saving {len(entries)} items to snapshot {self.path}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": ITEM_SNAPSHOT_VERSION, "items": entries}, f, ensure_ascii=False,
+                      separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+def load_item_snapshot(path: str) -> ItemSnapshot:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        log.info("No item snapshot found")
+        return ItemSnapshot(path)
+    except (OSError, ValueError) as e:
+        log.warning(f"Failed to read item snapshot, starting empty: {e}")
+        return ItemSnapshot(path)
+
+    if content.get("version") != ITEM_SNAPSHOT_VERSION:
+        log.info("Item snapshot has an incompatible version, starting empty")
+        return ItemSnapshot(path)
+
+    entries = content.get("items", {})
+    log.info(f"Loaded {len(entries)} items from snapshot")
+    return ItemSnapshot(path, entries)
@@ -1,11 +1,9 @@
 import json
 import logging
-from typing import Any
+from typing import Any, Optional
 
-import requests
-import requests.cookies
-
-from buecherhallen.common.constants import BASE_URL, SOLUS_APP_ID
+from buecherhallen.api.session import ApiSession
+from buecherhallen.common.constants import LISTS_API_URL, LAST_WATCHLIST_FILE
 from buecherhallen.media.list_item import ListItem
 
 log = logging.getLogger(__name__)
@@ -15,34 +13,26 @@ class WatchlistError(Exception):
     pass
 
 
-def retrieve_watchlist_items(list_name: str, cookies: requests.cookies.RequestsCookieJar) -> list[ListItem]:
+def retrieve_named_lists(list_names: list[str], session: ApiSession,
+                         lists: Optional[list[dict[str, Any]]] = None) -> dict[str, list[ListItem]]:
+    """Returns the items of every list in `list_names` the account has, fetching the lists unless they are given."""
     try:
-        raw_items = __retrieve_watchlist_raw_items(list_name, cookies)
-        return [ListItem.from_json(raw_item) for raw_item in raw_items]
+        if lists is None:
+            lists = __retrieve_lists(session)
+        named_lists = {}
+        for item_list in lists:
+            list_name = item_list.get("listName")
+            if list_name in list_names:
+                named_lists[list_name] = [ListItem.from_json(raw_item) for raw_item in item_list.get("items", [])]
+        return named_lists
     except Exception as e:
         raise WatchlistError(f"Error retrieving watchlist items: {e}")
 
 
-def __retrieve_watchlist_raw_items(list_name: str, cookies: requests.cookies.RequestsCookieJar) -> list[dict[str, Any]]:
-    lists = __retrieve_lists(cookies)
-
-    for item_list in lists:
-        if item_list.get("listName") == list_name:
-            watch_list_items = item_list.get("items", [])
-            return watch_list_items
-
-    raise WatchlistError(f"Cannot find list with name 'Merkliste'")
-
-
-def __retrieve_lists(cookies: requests.cookies.RequestsCookieJar) -> list[dict[str, Any]]:
+def __retrieve_lists(session: ApiSession) -> list[dict[str, Any]]:
     log.info("Fetching lists")
 
-    api_url = f'{BASE_URL}/api/items?type=lists'
-    response = requests.get(
-        api_url,
-        cookies=cookies,
-        headers={'Solus-App-Id': SOLUS_APP_ID}
-    )
+    response = session.get(LISTS_API_URL)
 
     status_code = response.status_code
     log.debug(f"Lists API response status code: {status_code}")
@@ -55,3 +45,21 @@ def __retrieve_lists(cookies: requests.cookies.RequestsCookieJar) -> list[dict[s
     log.debug(f"Lists API response JSON: {json.dumps(response_json, indent=2)}")
 
     return response_json
+
+
+def save_last_watchlist(list_items: list[ListItem]):
+    log.info(f"Saving {len(list_items)} watchlist items for the next run")
+    with open(LAST_WATCHLIST_FILE, "w", encoding="utf-8") as f:
+        json.dump([list_item.to_json() for list_item in list_items], f)
+
+
+def load_last_watchlist() -> Optional[list[ListItem]]:
+    try:
+        with open(LAST_WATCHLIST_FILE, "r", encoding="utf-8") as f:
+            return [ListItem.from_json(raw_item) for raw_item in json.load(f)]
+    except FileNotFoundError:
+        log.info("No watchlist from a previous run found")
+        return None
+    except (ValueError, TypeError, AttributeError, AssertionError) as e:
+        log.warning(f"Ignoring invalid watchlist from a previous run: {e}")
+        return None
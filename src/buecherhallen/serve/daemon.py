@@ -0,0 +1,107 @@
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+import traceback
+from typing import Callable
+
+from buecherhallen.app import AppContext, refresh, write_metrics
+from buecherhallen.common.constants import TEMPLATE_CACHE_DIR
+from buecherhallen.common.metrics import METRICS
+from buecherhallen.common.options import retrieve_options, Options
+from buecherhallen.common.profiling import PROFILER
+from buecherhallen.serve.http_server import ResourceStore, SiteServer
+from buecherhallen.ui.index import create_env
+from buecherhallen.ui.site import render_site
+
+log = logging.getLogger(__name__)
+
+# first delay after a failed refresh, doubled on every further failure up to the regular interval
+RETRY_DELAY_SECONDS = 30
+
+
+class RefreshLoop:
+    """Calls `refresh` right away and then every `interval` seconds, shifted by up to `jitter` seconds."""
+
+    def __init__(self, refresh_site: Callable[[], None], interval: int, jitter: int):
+        self.__refresh_site = refresh_site
+        self.__interval = interval
+        self.__jitter = jitter
+        self.__stopped = threading.Event()
+        self.__failures = 0
+
+    def run(self):
+        while not self.__stopped.is_set():
+            started_at = time.monotonic()
+            try:
+                self.__refresh_site()
+                self.__failures = 0
+                log.info(f"Refresh took {time.monotonic() - started_at:.1f}s")
+            except Exception as e:
+                self.__failures += 1
+                print(traceback.format_exc(), end='', file=sys.stderr)
+                log.error(f"Refresh failed ({self.__failures} in a row), serving the previous data: {e}")
+
+            delay = self.__next_delay()
+            log.info(f"Next refresh in {delay:.0f}s")
+            self.__stopped.wait(delay)
+
+    def stop(self):
+        self.__stopped.set()
+
+    def __next_delay(self) -> float:
+        if self.__failures:
+            return min(RETRY_DELAY_SECONDS * 2 ** (self.__failures - 1), self.__interval)
+        # jitter keeps refreshes from lining up with other clients polling on the full hour
+        return self.__interval + random.uniform(-self.__jitter, self.__jitter)
+
+
+def serve():
+    try:
+        options = retrieve_options()
+        PROFILER.configure(options.profile, options.profile_dir, options.profile_top)
+        with AppContext(options) as context:
+            __serve(context, options)
+    except Exception as e:
+        print(traceback.format_exc(), end='', file=sys.stderr)
+        print(f"\nError: {e}", file=sys.stderr)
+        exit(1)
+
+
+def __serve(context: AppContext, options: Options):
+    store = ResourceStore()
+    env = create_env(TEMPLATE_CACHE_DIR)
+
+    def refresh_site():
+        # the metrics describe the latest refresh, like those of a single run
+        METRICS.reset()
+        try:
+            result = refresh(context)
+            with METRICS.phase("render"):
+                files = render_site(result.items_by_list, options.output_mode, env)
+                changed = store.update({path: content.encode("utf-8") for path, content in files.items()})
+        finally:
+            write_metrics(options)
+        log.info(f"Serving {len(files)} files, {changed} changed")
+        if result.failed_share() > options.max_failed_share:
+            log.error(f"{result.failed} of {result.records} records failed, more than the allowed "
+                      f"{options.max_failed_share:.0%}")
+
+    loop = RefreshLoop(refresh_site, options.serve_interval, options.serve_jitter)
+    with SiteServer((options.serve_host, options.serve_port), store) as server:
+        def shutdown(signum, frame):
+            log.info(f"Received signal {signum}, shutting down")
+            loop.stop()
+            # `shutdown` blocks until `serve_forever` returns, so it must not run on the serving thread
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        refresh_thread = threading.Thread(target=loop.run, name="refresh", daemon=True)
+        refresh_thread.start()
+        log.warning(f"Serving on http://{options.serve_host}:{server.server_address[1]}/")
+        server.serve_forever()
+        refresh_thread.join()
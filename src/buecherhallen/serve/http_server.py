@@ -0,0 +1,181 @@
+import email.utils
+import hashlib
+import logging
+import mimetypes
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import resources
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit, unquote
+
+log = logging.getLogger(__name__)
+
+# static files served next to the pages, the apple touch icon is a copy of the largest favicon
+ASSET_ALIASES = {"apple-touch-icon.png": "favicon-512x512.png"}
+
+
+class Resource(NamedTuple):
+    body: bytes
+    content_type: str
+    etag: str
+    last_modified: float
+
+    @staticmethod
+    def of(path: str, body: bytes, last_modified: float) -> 'Resource':
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        if path.endswith(".json"):
+            content_type = "application/json; charset=utf-8"
+        else:
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if content_type.startswith("text/"):
+                content_type += "; charset=utf-8"
+        return Resource(body, content_type, etag, last_modified)
+
+
+class ResourceStore:
+    """Thread-safe in-memory copy of the site, swapped as a whole after every refresh."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__resources: dict[str, Resource] = {}
+        self.__updated_at: Optional[float] = None
+
+    @property
+    def updated_at(self) -> Optional[float]:
+        return self.__updated_at
+
+    def update(self, files: dict[str, bytes]) -> int:
+        """Replaces the site with `files`, returns the number of files that are new or changed."""
+        now = time.time()
+        with self.__lock:
+            previous = self.__resources
+        resources_by_path = {}
+        changed = 0
+        for path, body in files.items():
+            old = previous.get(path)
+            if old is not None and old.body == body:
+                resources_by_path[path] = old
+                continue
+            resources_by_path[path] = Resource.of(path, body, now)
+            changed += 1
+        with self.__lock:
+            self.__resources = resources_by_path
+            self.__updated_at = now
+        return changed
+
+    def get(self, path: str) -> Optional[Resource]:
+        with self.__lock:
+            return self.__resources.get(path)
+
+
+class SiteRequestHandler(BaseHTTPRequestHandler):
+    server: 'SiteServer'
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.__respond(send_body=True)
+
+    def do_HEAD(self):
+        self.__respond(send_body=False)
+
+    def log_message(self, format, *args):
+        log.debug(f"{self.address_string()} - {format % args}")
+
+    def __respond(self, send_body: bool):
+        path = self.__resource_path()
+        if path is None:
+            self.__send_status(404, "Not Found", send_body)
+            return
+
+        resource = self.server.resources.get(path)
+        if resource is None:
+            resource = self.server.asset(path)
+        if resource is None:
+            if self.server.resources.updated_at is None:
+                # nothing rendered yet, the first refresh is still running
+                self.__send_status(503, "Service Unavailable", send_body, {"Retry-After": "30"})
+            else:
+                self.__send_status(404, "Not Found", send_body)
+            return
+
+        headers = {
+            "ETag": resource.etag,
+            "Last-Modified": email.utils.formatdate(resource.last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if self.__is_not_modified(resource):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", resource.content_type)
+        self.send_header("Content-Length", str(len(resource.body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(resource.body)
+
+    def __resource_path(self) -> Optional[str]:
+        path = unquote(urlsplit(self.path).path).lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        if any(part in ("", ".", "..") for part in path.split("/")):
+            return None
+        return path
+
+    def __is_not_modified(self, resource: Resource) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = [etag.strip().removeprefix("W/") for etag in if_none_match.split(",")]
+            return "*" in etags or resource.etag in etags
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(resource.last_modified) <= since
+
+    def __send_status(self, status: int, message: str, send_body: bool, headers: Optional[dict[str, str]] = None):
+        body = f"{status} {message}\n".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+class SiteServer(ThreadingHTTPServer):
+    """Serves the pages from a `ResourceStore` and the favicons from the package assets."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], resources_store: ResourceStore):
+        super().__init__(address, SiteRequestHandler)
+        self.resources = resources_store
+        self.__assets: dict[str, Resource] = {}
+        self.__load_assets()
+
+    def asset(self, path: str) -> Optional[Resource]:
+        return self.__assets.get(path)
+
+    def __load_assets(self):
+        started_at = time.time()
+        assets = resources.files("buecherhallen.ui").joinpath("assets")
+        for asset in assets.iterdir():
+            if asset.name.startswith("favicon"):
+                self.__assets[asset.name] = Resource.of(asset.name, asset.read_bytes(), started_at)
+        for alias, name in ASSET_ALIASES.items():
+            if name in self.__assets:
+                self.__assets[alias] = self.__assets[name]
+
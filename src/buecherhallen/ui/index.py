@@ -1,27 +1,125 @@
+import json
+import os
+import re
+import time
 from datetime import datetime
+from typing import Iterator, NamedTuple, Optional, TYPE_CHECKING
 from zoneinfo import ZoneInfo
 
-from jinja2 import Environment, PackageLoader, select_autoescape
-
 from buecherhallen.media.item import Item
 
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+
+class Row(NamedTuple):
+    """Everything the template shows for one item at one location, computed once per (item, location)."""
+    url: str
+    title: str
+    icon: Optional[str]
+    count: int
+    max_count: int
+    shelf_or_signature: str
+    # age of the data if the item could not be refreshed, e.g. "3 Std."
+    stale_age: Optional[str] = None
+    # time since copies became available at the location, if the history knows it
+    available_age: Optional[str] = None
+
 
-def create_env() -> Environment:
+def create_env(bytecode_cache_dir: Optional[str] = None) -> 'Environment':
+    # only imported once there is something to render
+    from jinja2 import Environment, PackageLoader, select_autoescape, FileSystemBytecodeCache
+
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
     return Environment(
-        loader=PackageLoader("ui"),
-        autoescape=select_autoescape()
+        loader=PackageLoader("buecherhallen.ui"),
+        autoescape=select_autoescape(),
+        bytecode_cache=bytecode_cache,
     )
 
 
-def render_index(env: Environment, items: list[Item]) -> str:
-    available_items_by_location: dict = {}
+def build_rows(items: list[Item]) -> dict[str, list[Row]]:
+    rows_by_location: dict[str, list[Row]] = {}
     for item in items:
-        for location, availability in item.availabilities.availabilities.items():
-            if availability.is_available():
-                if location not in available_items_by_location:
-                    available_items_by_location[location] = []
-                available_items_by_location[location].append(item)
+        url = item.get_url()
+        icon = item.get_icon()
+        signature = item.get_clean_signature()
+        stale_age = format_age(time.time() - item.stale_since) if item.stale_since is not None else None
+        available_since = item.available_since or {}
+        for location, availability in item.availabilities.available():
+            since = available_since.get(location)
+            row = Row(url, item.title, icon, availability.count, availability.max_count,
+                      availability.shelf if availability.shelf else signature, stale_age,
+                      format_age(time.time() - since) if since is not None else None)
+            if location not in rows_by_location:
+                rows_by_location[location] = []
+            rows_by_location[location].append(row)
+    return rows_by_location
+
+
+class LocationPage(NamedTuple):
+    filename: str
+    count: int
+
+
+def format_age(seconds: float) -> str:
+    minutes = max(int(seconds // 60), 1)
+    if minutes < 60:
+        return f"{minutes} Min."
+    hours = minutes // 60
+    if hours < 48:
+        return f"{hours} Std."
+    return f"{hours // 24} Tagen"
+
+
+def get_current_time() -> str:
+    return datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y %H:%M")
+
+
+def slugify(name: str) -> str:
+    slug = name.lower()
+    for umlaut, replacement in (("ä", "ae"), ("ö", "oe"), ("ü", "ue"), ("ß", "ss")):
+        slug = slug.replace(umlaut, replacement)
+    return re.sub(r"[^a-z0-9]+", "-", slug).strip("-")
 
-    current_time = datetime.now(ZoneInfo("Europe/Berlin")).strftime("%d.%m.%Y %H:%M")
+
+def location_filename(location: str) -> str:
+    return f"location-{slugify(location)}.html"
+
+
+def stream_index(env: 'Environment', items: list[Item], root: str = "", list_name: Optional[str] = None) -> Iterator[str]:
     template = env.get_template("index.j2")
-    return template.render(location_mapping=available_items_by_location, current_time=current_time)
+    return template.generate(location_mapping=build_rows(items), current_time=get_current_time(), root=root,
+                             list_name=list_name)
+
+
+def stream_location(env: 'Environment', location: str, rows: list[Row], root: str = "",
+                    list_name: Optional[str] = None) -> Iterator[str]:
+    template = env.get_template("location.j2")
+    return template.generate(location=location, rows=rows, root=root, list_name=list_name)
+
+
+def stream_locations_index(env: 'Environment', location_pages: dict[str, LocationPage], root: str = "",
+                           list_name: Optional[str] = None) -> Iterator[str]:
+    template = env.get_template("locations.j2")
+    return template.generate(location_pages=location_pages, current_time=get_current_time(), root=root,
+                             list_name=list_name)
+
+
+def stream_lists_index(env: 'Environment', list_directories: dict[str, str]) -> Iterator[str]:
+    template = env.get_template("lists.j2")
+    return template.generate(list_directories=list_directories, current_time=get_current_time())
+
+
+def availability_json(rows_by_location: dict[str, list[Row]]) -> str:
+    return json.dumps({
+        "fields": Row._fields,
+        "locations": {location: [list(row) for row in rows] for location, rows in sorted(rows_by_location.items())},
+    }, ensure_ascii=False, separators=(",", ":"))
+
+
+def render_index(env: 'Environment', items: list[Item]) -> str:
+    return "".join(stream_index(env, items))
@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+log = logging.getLogger(__name__)
+
+COMPRESSED_SUFFIXES = (".gz", ".br")
+# template streams yield many tiny chunks, they are joined into blocks of about this many characters before writing
+WRITE_BLOCK_CHARS = 1 << 12
+
+
+def write_if_changed(path: str, chunks: Iterable[str], precompress: bool = False) -> bool:
+    """Atomically writes the content to `path` if it changed, returns whether it was written."""
+    directory = os.path.dirname(path) or "."
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in __blocks(chunks):
+                data = block.encode("utf-8")
+                digest.update(data)
+                f.write(data)
+
+        if __file_hash(path) == digest.digest():
+            log.debug(f"{path} is unchanged")
+            os.remove(tmp_path)
+            if precompress and not all(os.path.exists(path + suffix) for suffix in __available_suffixes()):
+                __write_compressed(path)
+            return False
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    log.info(f"Wrote {path}")
+    if precompress:
+        __write_compressed(path)
+    return True
+
+
+def remove_output(path: str):
+    for file in (path, *(path + suffix for suffix in COMPRESSED_SUFFIXES)):
+        if os.path.exists(file):
+            log.info(f"Removing stale {file}")
+            os.remove(file)
+
+
+def __blocks(chunks: Iterable[str]) -> Iterator[str]:
+    buffer: list[str] = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= WRITE_BLOCK_CHARS:
+            yield "".join(buffer)
+            buffer.clear()
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def __file_hash(path: str) -> Optional[bytes]:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.digest()
+
+
+def __available_suffixes() -> tuple[str, ...]:
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return ".gz",
+    return COMPRESSED_SUFFIXES
+
+
+def __write_compressed(path: str):
+    with open(path, "rb") as f:
+        content = f.read()
+
+    # mtime=0 keeps the compressed file identical for identical content
+    __write_atomic(path + ".gz", gzip.compress(content, compresslevel=9, mtime=0))
+
+    try:
+        import brotli
+    except ImportError:
+        log.debug("brotli is not installed, skipping .br output")
+        return
+    __write_atomic(path + ".br", brotli.compress(content, quality=11))
+
+
+def __write_atomic(path: str, content: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
@@ -1,13 +1,83 @@
+import glob
 import logging
+import os
+from typing import Iterable, Iterator, Optional
 
-from buecherhallen.ui.index import render_index, create_env
+from buecherhallen.common.constants import TEMPLATE_CACHE_DIR
+from buecherhallen.media.item import Item
+from buecherhallen.ui.index import stream_index, create_env, build_rows, stream_location, stream_locations_index, \
+    availability_json, location_filename, LocationPage, stream_lists_index, slugify
+from buecherhallen.ui.output import write_if_changed, remove_output
 
 log = logging.getLogger(__name__)
 
+OUTPUT_DIR = "output"
 
-def generate_website(items):
-    log.info("Generating website")
-    env = create_env()
-    index = render_index(env, items)
-    with open("output/index.html", "w") as f:
-        f.write(index)
+
+def generate_website(items: list[Item], output_mode: str = "single", precompress: bool = False,
+                     output_dir: str = OUTPUT_DIR, root: str = "", list_name: Optional[str] = None,
+                     env=None):
+    log.info(f"Generating website in {output_dir}")
+    env = env or create_env(TEMPLATE_CACHE_DIR)
+    __write_files(output_dir, __website_files(env, items, output_mode, root, list_name), precompress)
+
+
+def generate_list_websites(items_by_list: dict[str, list[Item]], output_mode: str = "single",
+                           precompress: bool = False):
+    """Renders one view per list, in its own directory below a page linking all lists if there is more than one."""
+    log.info(f"Generating website in {OUTPUT_DIR}")
+    env = create_env(TEMPLATE_CACHE_DIR)
+    __write_files(OUTPUT_DIR, __site_files(env, items_by_list, output_mode), precompress)
+
+
+def render_site(items_by_list: dict[str, list[Item]], output_mode: str = "single", env=None) -> dict[str, str]:
+    """Renders every file `generate_list_websites` writes, keyed by its path in the output directory."""
+    env = env or create_env(TEMPLATE_CACHE_DIR)
+    return {path: "".join(chunks) for path, chunks in __site_files(env, items_by_list, output_mode)}
+
+
+def __site_files(env, items_by_list: dict[str, list[Item]], output_mode: str) -> Iterator[tuple[str, Iterable[str]]]:
+    if len(items_by_list) == 1:
+        yield from __website_files(env, next(iter(items_by_list.values())), output_mode)
+        return
+
+    list_directories = {list_name: slugify(list_name) for list_name in items_by_list}
+    for list_name, items in items_by_list.items():
+        for path, chunks in __website_files(env, items, output_mode, "../", list_name):
+            yield f"{list_directories[list_name]}/{path}", chunks
+    yield "index.html", stream_lists_index(env, list_directories)
+
+
+def __website_files(env, items: list[Item], output_mode: str, root: str = "",
+                    list_name: Optional[str] = None) -> Iterator[tuple[str, Iterable[str]]]:
+    """Yields the path and the content of every file of one list, split mode adds a page per location and JSON."""
+    if output_mode != "split":
+        yield "index.html", stream_index(env, items, root, list_name)
+        return
+
+    rows_by_location = build_rows(items)
+    location_pages = {location: LocationPage(location_filename(location), len(rows))
+                      for location, rows in rows_by_location.items()}
+    for location, rows in rows_by_location.items():
+        yield location_pages[location].filename, stream_location(env, location, rows, root, list_name)
+    # the index page carries the update time, the location pages and the JSON only change with the data
+    yield "index.html", stream_locations_index(env, location_pages, root, list_name)
+    yield "availability.json", [availability_json(rows_by_location)]
+
+
+def __write_files(output_dir: str, files: Iterable[tuple[str, Iterable[str]]], precompress: bool):
+    written = set()
+    changed = 0
+    for path, chunks in files:
+        path = os.path.join(output_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        changed += write_if_changed(path, chunks, precompress)
+        written.add(path)
+
+    # pages of locations without available items anymore, or of a previous run in split mode
+    for directory in {os.path.dirname(path) for path in written}:
+        for path in glob.glob(os.path.join(directory, "location-*.html")):
+            if path not in written:
+                remove_output(path)
+
+    log.info(f"Wrote {changed} changed of {len(written)} files")